@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Hermetic benchmark of the status, cancel, and submission hot paths.
+# The fake scheduler commands in bench/stubs are put on PATH, and HOME points to a temporary directory,
+# so neither a real scheduler nor the files of the user are touched.
+# For each backend, the latency of `xstat -m` and `xdel -m` is measured while the queue size and the number of
+# requested ids grow, and the throughput of `xsub --batch` is measured for a number of jobs.
+
+import argparse,json,os,sys,subprocess,time,statistics,pathlib,tempfile,datetime,shutil
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+BIN_DIR = BENCH_DIR.parent.joinpath("bin")
+STUB_DIR = BENCH_DIR.joinpath("stubs")
+FIRST_JOB_ID = 1000000   # same as in stubs/_stub.py
+
+def env_for(backend, queue_size, parsed, home):
+  env = dict(os.environ)
+  env.update({
+    "PATH": f"{STUB_DIR}{os.pathsep}{env.get('PATH', '')}",
+    "HOME": home,
+    "XSUB_TYPE": backend,
+    "XSUB_STUB_QUEUE_SIZE": str(queue_size),
+    "XSUB_STUB_LATENCY": str(parsed.latency),
+    "XSUB_STUB_DIR": home,
+    "XSUB_NO_DAEMON": "1",
+    "XSUB_STATUS_CACHE_TTL": str(parsed.cache_ttl),
+  })
+  for key in ("XSUB_DAEMON_SOCKET", "XSUB_CACHE_DIR", "XSUB_REGISTRY", "XSUB_NONE_DIR", "XSUB_STUB_LOG"):
+    env.pop(key, None)
+  return env
+
+def requested_ids(queue_size, num_ids):
+  # half of the ids are in the queue, and the others have already left it
+  in_queue = [str(FIRST_JOB_ID + (i*7919) % queue_size) for i in range((num_ids+1)//2)]
+  finished = [str(FIRST_JOB_ID - 1 - i) for i in range(num_ids//2)]
+  return in_queue + finished
+
+def timed(cmd, env, stdin=None):
+  start = time.perf_counter()
+  subprocess.run(cmd, env=env, input=stdin, check=True, stdout=subprocess.DEVNULL)
+  return time.perf_counter() - start
+
+def summarize(values):
+  values = sorted(values)
+  return {"p50": statistics.median(values), "p95": values[min(len(values)-1, int(len(values)*0.95))], "min": values[0]}
+
+def bench_status(backend, parsed, home):
+  results = []
+  for queue_size in parsed.queue_sizes:
+    env = env_for(backend, queue_size, parsed, home)
+    for num_ids in parsed.num_ids:
+      ids = requested_ids(queue_size, num_ids)
+      for (name,cmd,stdin) in [
+        ("xstat -m", [sys.executable, str(BIN_DIR.joinpath("xstat")), "-m", "-"], None),
+        ("xdel -m", [sys.executable, str(BIN_DIR.joinpath("xdel")), "-m", "-"], None)
+      ]:
+        if name == "xstat -m":
+          cmd = cmd[:-1] + ids   # xstat takes the ids as arguments
+        else:
+          stdin = "\n".join(ids).encode()
+        seconds = [timed(cmd, env, stdin) for _ in range(parsed.repeat)]
+        s = summarize(seconds)
+        results.append({"backend": backend, "command": name, "queue_size": queue_size, "num_ids": num_ids,
+                        "latency_s": s, "ids_per_s": num_ids / s["p50"]})
+  return results
+
+def bench_submit(backend, parsed, home, work):
+  env = env_for(backend, parsed.queue_sizes[0], parsed, home)
+  results = []
+  job_script = pathlib.Path(work).joinpath("job.sh")
+  job_script.write_text("true\n")
+  for num_jobs in parsed.num_jobs:
+    seconds = []
+    for r in range(parsed.repeat):
+      d = pathlib.Path(work).joinpath(f"{backend}_{num_jobs}_{r}")
+      lines = [json.dumps({"job_script": str(job_script), "dir": str(d.joinpath(str(i))), "log": str(d.joinpath("log"))}) for i in range(num_jobs)]
+      seconds.append(timed([sys.executable, str(BIN_DIR.joinpath("xsub")), "--batch", "-"], env, "\n".join(lines).encode()))
+      shutil.rmtree(d, ignore_errors=True)
+    s = summarize(seconds)
+    results.append({"backend": backend, "command": "xsub --batch", "queue_size": parsed.queue_sizes[0], "num_ids": num_jobs,
+                    "latency_s": s, "ids_per_s": num_jobs / s["p50"]})
+  return results
+
+parser = argparse.ArgumentParser(description="benchmark of xsub, xstat, and xdel against fake scheduler commands")
+parser.add_argument("-b", "--backends", nargs='+', default=["slurm", "torque", "pbs_pro", "fugaku"])
+parser.add_argument("-q", "--queue-sizes", nargs='+', type=int, default=[1000, 10000, 100000], help="number of jobs in the synthetic queue")
+parser.add_argument("-i", "--num-ids", nargs='+', type=int, default=[1, 100, 2000], help="number of job ids given to xstat and xdel")
+parser.add_argument("-j", "--num-jobs", nargs='+', type=int, default=[1, 100], help="number of jobs submitted by xsub --batch")
+parser.add_argument("-n", "--repeat", type=int, default=3)
+parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each call of a scheduler command")
+parser.add_argument("--cache-ttl", type=float, default=0.0, help="XSUB_STATUS_CACHE_TTL used during the benchmark")
+parser.add_argument("-o", "--output", help="append the results to this JSON lines file")
+parsed = parser.parse_args()
+
+timestamp = datetime.datetime.now().isoformat()
+results = []
+with tempfile.TemporaryDirectory() as home:
+  for backend in parsed.backends:
+    results += bench_status(backend, parsed, home)
+    results += bench_submit(backend, parsed, home, home)
+
+print(f"{'backend':<8} {'command':<13} {'queue':>7} {'ids':>6} {'p50 [s]':>9} {'p95 [s]':>9} {'ids/s':>10}")
+for r in results:
+  print(f"{r['backend']:<8} {r['command']:<13} {r['queue_size']:>7} {r['num_ids']:>6} {r['latency_s']['p50']:>9.3f} {r['latency_s']['p95']:>9.3f} {r['ids_per_s']:>10.1f}")
+
+if parsed.output:
+  with open(parsed.output, mode='a') as f:
+    for r in results:
+      r.update({"time": timestamp, "latency": parsed.latency, "cache_ttl": parsed.cache_ttl, "repeat": parsed.repeat})
+      f.write(json.dumps(r) + "\n")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Measures the startup latency of the xsub, xstat, and xdel entry points.
+# For each entry point, the time until the first byte of output and the total wall time are measured,
+# together with the time to import the modules and to create the scheduler.
+# The thresholds in startup_thresholds.json are multiples of the median of the bare interpreter ("python") measured in
+# the same run, so they do not depend on the speed of the machine. The exit code is 1 on a regression, unless --advisory.
+
+import argparse,json,os,sys,subprocess,time,statistics,pathlib,tempfile,datetime
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+BIN_DIR = BENCH_DIR.parent.joinpath("bin")
+
+ENTRY_POINTS = {
+  "python": [sys.executable, "-c", "pass"],
+  # modules imported before a request is sent to xsubd, and those imported when the command runs by itself
+  "import client": [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import argparse,json,xsub_daemon; print()", str(BIN_DIR)],
+  "import direct": [sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import schedulers; schedulers.Session(snapshot_ttl=0); print()", str(BIN_DIR)],
+  "xsub -t": [sys.executable, str(BIN_DIR.joinpath("xsub")), "-t"],
+  "xstat": [sys.executable, str(BIN_DIR.joinpath("xstat"))],
+  "xstat -m": [sys.executable, str(BIN_DIR.joinpath("xstat")), "-m"] + [str(4194304+i) for i in range(100)],
+  "xdel": [sys.executable, str(BIN_DIR.joinpath("xdel")), "4194304"],
+}
+
+def measure(cmd, env):
+  # returns (seconds until the first output, seconds until exit)
+  start = time.perf_counter()
+  proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  proc.stdout.read(1)
+  first = time.perf_counter() - start
+  proc.stdout.read()
+  if proc.wait() != 0:
+    raise Exception(f"{cmd} failed with rc {proc.returncode}")
+  return (first, time.perf_counter() - start)
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values)-1, int(len(values)*p))]
+
+parser = argparse.ArgumentParser(description="startup benchmark of the xsub commands")
+parser.add_argument("-n", "--repeat", help="number of runs for each entry point", type=int, default=20)
+parser.add_argument("-t", "--thresholds", help="JSON file of the thresholds as multiples of the startup of python", default=str(BENCH_DIR.joinpath("startup_thresholds.json")))
+parser.add_argument("--advisory", help="only report the regressions, and exit with 0", action='store_true')
+parser.add_argument("-o", "--output", help="append the results to this JSON lines file")
+parser.add_argument("--daemon", help="measure the commands sending their requests to a running xsubd", action='store_true')
+parsed = parser.parse_args()
+
+env = dict(os.environ)
+env.setdefault("XSUB_TYPE", "none")
+env["XSUB_NO_DAEMON"] = "" if parsed.daemon else "1"
+env["XSUB_NONE_DIR"] = tempfile.mkdtemp()
+
+with open(parsed.thresholds) as f:
+  thresholds = json.load(f)
+
+results = []
+for (name,cmd) in ENTRY_POINTS.items():
+  measure(cmd, env)   # warm up the file system cache
+  firsts, totals = [], []
+  for _ in range(parsed.repeat):
+    first, total = measure(cmd, env)
+    firsts.append(first*1000)
+    totals.append(total*1000)
+  results.append({
+    "entry_point": name, "xsub_type": env["XSUB_TYPE"], "daemon": parsed.daemon, "repeat": parsed.repeat,
+    "first_output_ms": {"p50": statistics.median(firsts), "p95": percentile(firsts, 0.95)},
+    "total_ms": {"p50": statistics.median(totals), "p95": percentile(totals, 0.95)}
+  })
+
+baseline = next(r["total_ms"]["p50"] for r in results if r["entry_point"] == "python")
+failed = False
+timestamp = datetime.datetime.now().isoformat()
+print(f"{'entry point':<14} {'first p50':>10} {'first p95':>10} {'total p50':>10} {'total p95':>10} {'limit':>8}")
+for r in results:
+  limit = thresholds[r["entry_point"]] * baseline if r["entry_point"] in thresholds else None
+  regressed = limit is not None and r["total_ms"]["p50"] > limit
+  failed = failed or regressed
+  r["threshold_ms"] = limit
+  r["baseline_ms"] = baseline
+  r["regressed"] = regressed
+  r["time"] = timestamp
+  print(f"{r['entry_point']:<14} {r['first_output_ms']['p50']:>10.1f} {r['first_output_ms']['p95']:>10.1f} {r['total_ms']['p50']:>10.1f} {r['total_ms']['p95']:>10.1f} {f'{limit:.1f}' if limit is not None else '-':>8}" + ("  REGRESSION" if regressed else ""))
+
+if parsed.output:
+  with open(parsed.output, mode='a') as f:
+    for r in results:
+      f.write(json.dumps(r) + "\n")
+
+sys.exit(1 if failed and not parsed.advisory else 0)
@@ -0,0 +1,169 @@
+# Fake scheduler commands for the benchmarks. They never touch a real scheduler.
+#
+# The synthetic queue holds XSUB_STUB_QUEUE_SIZE jobs with ids starting from FIRST_JOB_ID.
+# Each call sleeps XSUB_STUB_LATENCY seconds to emulate a busy controller.
+# XSUB_TYPE selects the dialect of qsub/qstat/qdel ("torque" or "pbs_pro").
+# When XSUB_STUB_LOG is set, the argv of each call is appended to that file.
+# XSUB_STUB_FAIL makes commands fail with a message (see injected_failure).
+
+import os,sys,json,time,fcntl,getpass,tempfile
+
+FIRST_JOB_ID = 1000000
+HOST = "bench"
+
+def queue_size():
+  return int(os.environ.get('XSUB_STUB_QUEUE_SIZE') or 1000)
+
+def queue_ids():
+  return [str(FIRST_JOB_ID + i) for i in range(queue_size())]
+
+def state_of(job_id, states):
+  # deterministic state for each job
+  return states[int(job_id) % len(states)]
+
+def base_id(job_id):
+  # "1000001.bench" -> "1000001", "1000001_3" -> "1000001", "1000001[3]" -> "1000001"
+  for sep in ('.', '_', '['):
+    job_id = job_id.split(sep)[0]
+  return job_id
+
+def in_queue(job_id):
+  b = base_id(job_id)
+  return b.isdigit() and FIRST_JOB_ID <= int(b) < FIRST_JOB_ID + queue_size()
+
+def next_job_id():
+  # submitted jobs get ids after the synthetic queue
+  path = os.path.join(os.environ.get('XSUB_STUB_DIR') or tempfile.gettempdir(), f"xsub_stub_counter_{os.getuid()}")
+  with open(path, mode='a+') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.seek(0)
+    n = int(f.read() or 0) + 1
+    f.seek(0)
+    f.truncate()
+    f.write(str(n))
+  return str(FIRST_JOB_ID + 10000000 + n)
+
+def option_value(args, name):
+  if name in args:
+    return args[args.index(name)+1]
+  return None
+
+def operands(args, options_with_value):
+  ops = []
+  skip = False
+  for a in args:
+    if skip:
+      skip = False
+    elif a in options_with_value:
+      skip = True
+    elif not a.startswith('-'):
+      ops.append(a)
+  return ops
+
+def squeue(args):
+  fmt = option_value(args, "-o") or "%i %P %j %u %t %M %D %R"
+  ids = option_value(args, "-j")
+  requested = ids.split(',') if ids else queue_ids()
+  found = [j for j in requested if in_queue(j)]
+  if ids and len(requested) == 1 and not found:
+    print("slurm_load_jobs error: Invalid job id specified", file=sys.stderr)
+    return 1
+  fields = {"%i": None, "%P": "bench", "%j": "job", "%u": "bench", "%t": None, "%M": "1:23", "%D": "1", "%R": "node001"}
+  lines = [] if "-h" in args else [fmt.replace("%i", "JOBID").replace("%t", "ST")]
+  for j in found:
+    line = fmt
+    for (k,v) in fields.items():
+      line = line.replace(k, v if v is not None else (j if k == "%i" else state_of(base_id(j), ["R", "PD", "R", "CG"])))
+    lines.append(line)
+  print("\n".join(lines))
+  return 0
+
+def qstat(args):
+  flavor = os.environ.get('XSUB_TYPE', 'torque').lower()
+  requested = operands(args, {"-F", "-u"}) or queue_ids()
+  rc = 0
+  found = []
+  for j in requested:
+    if in_queue(j):
+      found.append(j if '.' in j else f"{j}.{HOST}")
+    else:
+      print(f"qstat: Unknown Job Id {j}", file=sys.stderr)
+      rc = 153
+  if flavor == "pbs_pro" and option_value(args, "-F") == "json":
+    jobs = {j: {"Job_Name": "job", "Job_Owner": f"{getpass.getuser()}@{HOST}", "job_state": state_of(base_id(j), ["R", "Q", "R", "H"]), "queue": "workq"} for j in found}
+    if not operands(args, {"-F", "-u"}):
+      jobs[f"999999.{HOST}"] = {"Job_Name": "job", "Job_Owner": f"someone@{HOST}", "job_state": "R", "queue": "workq"}
+    print(json.dumps({"timestamp": int(time.time()), "pbs_version": "stub", "pbs_server": HOST, "Jobs": jobs}, indent=4))
+    return rc
+  states = ["R", "Q", "R", "E"]
+  print("Job ID                    Name             User            Time Use S Queue")
+  print("------------------------- ---------------- --------------- -------- - -----")
+  if not operands(args, {"-F", "-u"}):
+    print(f"{'999999.' + HOST:<25} {'job':<16} {'someone':<15} {'00:01:23':>8} R batch")   # listed for every user
+  for j in found:
+    print(f"{j:<25} {'job':<16} {getpass.getuser()[:15]:<15} {'00:01:23':>8} {state_of(base_id(j), states)} batch")
+  return rc
+
+def qselect(args):
+  # the ids of the user's jobs. The job of another user in the qstat listing (999999) is never selected.
+  user = option_value(args, "-u")
+  if user is not None and user != getpass.getuser():
+    return 0
+  for j in queue_ids():
+    print(f"{j}.{HOST}")
+  return 0
+
+def pjstat(args):
+  requested = operands(args, {"--choose"}) or queue_ids()
+  found = [j for j in requested if in_queue(j)]
+  states = ["RUN", "QUE", "RUN", "HLD"]
+  if option_value(args, "--choose") == "jid,st":
+    print("JOB_ID     ST")
+    for j in found:
+      print(f"{j:<10} {state_of(base_id(j), states)}")
+  else:
+    print("JOB_ID     JOB_NAME   MD ST  USER     START_DATE      ELAPSE_LIM NODE_REQUIRE")
+    for j in found:
+      print(f"{j:<10} job        NM {state_of(base_id(j), states)} bench    -               0001:00:00 1")
+  return 0
+
+def sbatch(args):
+  print(f"Submitted batch job {next_job_id()}")
+  return 0
+
+def qsub(args):
+  job_id = next_job_id()
+  print(f"{job_id}[].{HOST}" if "-J" in args else f"{job_id}.{HOST}")
+  return 0
+
+def pjsub(args):
+  print(f"[INFO] PJM 0000 pjsub Job {next_job_id()} submitted.")
+  return 0
+
+def cancel(args):
+  return 0
+
+COMMANDS = {
+  "squeue": squeue, "sbatch": sbatch, "scancel": cancel,
+  "qstat": qstat, "qselect": qselect, "qsub": qsub, "qdel": cancel,
+  "pjstat": pjstat, "pjsub": pjsub, "pjdel": cancel,
+}
+
+def injected_failure(name):
+  # XSUB_STUB_FAIL="scancel=Unable to contact slurm controller;qstat=..." makes the commands fail with the messages
+  for item in (os.environ.get('XSUB_STUB_FAIL') or '').split(';'):
+    command, _, message = item.partition('=')
+    if command == name:
+      return message
+  return None
+
+def main(name):
+  if os.environ.get('XSUB_STUB_LOG'):
+    with open(os.environ['XSUB_STUB_LOG'], mode='a') as f:
+      f.write(json.dumps([name] + sys.argv[1:]) + "\n")
+  time.sleep(float(os.environ.get('XSUB_STUB_LATENCY') or 0))
+  message = injected_failure(name)
+  if message is not None:
+    print(message, file=sys.stderr)
+    sys.exit(1)
+  sys.exit(COMMANDS[name](sys.argv[1:]))
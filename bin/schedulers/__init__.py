@@ -1,20 +1,43 @@
-import os,sys
-from . import none
-from . import torque
-from . import fugaku
-from . import slurm
-from . import pbs_pro
+import os,sys,importlib
 
 
+# Each scheduler module is imported only when it is selected by XSUB_TYPE.
+# A value is either a scheduler class or "module:Class". Modules starting with "." are looked up in this package.
 SCHEDULER_TYPES = {
-  "none": none.NoneScheduler,
-  "torque": torque.TorqueScheduler,
-  "fugaku": fugaku.FugakuScheduler,
-  "slurm": slurm.SlurmScheduler,
-  "pbs_pro": pbs_pro.PBSProScheduler
+  "none": ".none:NoneScheduler",
+  "torque": ".torque:TorqueScheduler",
+  "fugaku": ".fugaku:FugakuScheduler",
+  "slurm": ".slurm:SlurmScheduler",
+  "pbs_pro": ".pbs_pro:PBSProScheduler",
+  "multi": ".multi:MultiScheduler"
 }
 
+def register(name, scheduler):
+  SCHEDULER_TYPES[name.lower()] = scheduler
+
+def _register_plugins():
+  # site-local schedulers are given like XSUB_SCHEDULER_PLUGINS="my_scheduler=my_module:MyScheduler,..."
+  # `my_module` must be importable, e.g. by adding its directory to PYTHONPATH.
+  plugins = os.environ.get('XSUB_SCHEDULER_PLUGINS', '')
+  for item in plugins.split(','):
+    if not item.strip():
+      continue
+    if not '=' in item:
+      raise Exception(f"invalid plugin {item}: it must be given as name=module:Class")
+    name, target = item.split('=', 1)
+    register(name.strip(), target.strip())
+
+def load(xsub_type):
+  scheduler = SCHEDULER_TYPES[xsub_type]
+  if isinstance(scheduler, str):
+    module_name, class_name = scheduler.split(':')
+    module = importlib.import_module(module_name, __name__)
+    scheduler = getattr(module, class_name)
+    SCHEDULER_TYPES[xsub_type] = scheduler
+  return scheduler
+
 def create():
+  _register_plugins()
   if not 'XSUB_TYPE' in os.environ:
     print(f"[Error] Set environment variable 'XSUB_TYPE'")
     print(f"        available values are {','.join(SCHEDULER_TYPES.keys())}")
@@ -23,4 +46,11 @@ def create():
   if not xsub_type in SCHEDULER_TYPES:
     print(f"[Error] invalid scheduler type {xsub_type}", file=sys.stderr)
     raise Exception(f"scheduler type {xsub_type} is not found")
-  return SCHEDULER_TYPES[xsub_type]
+  return load(xsub_type)
+
+def __getattr__(name):
+  # the Python API (session.py) is imported on first use, so that the commands talking to xsubd do not load it
+  if name == "Session":
+    from .session import Session
+    return Session
+  raise AttributeError(f"module {__name__} has no attribute {name}")
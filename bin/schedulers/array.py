@@ -0,0 +1,20 @@
+import pathlib,os,tempfile
+from typing import List,Tuple
+
+# Helpers for the schedulers that submit many parent scripts with identical resources as a single job array.
+# A dispatch script selects the parent script by the array index, and the scheduler's own parent script
+# (with its resource directives) sources the dispatch script.
+
+def _write_unique(directory: pathlib.Path, prefix: str, content: str) -> pathlib.Path:
+  fd, path = tempfile.mkstemp(prefix=prefix, suffix=".sh", dir=directory)
+  with os.fdopen(fd, mode='w') as f:
+    f.write(content)
+  return pathlib.Path(path)
+
+def prepare_array_script(scheduler, scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, parameters: dict, index_var: str) -> pathlib.Path:
+  # `scripts` is a list of (parent script, work dir). The returned script runs the one at index `$index_var`.
+  cases = [f"{i}) cd {work_dir.absolute()} && . {script_path.absolute()} ;;" for (i,(script_path,work_dir)) in enumerate(scripts)]
+  dispatch = f"case ${index_var} in\n" + "\n".join(cases) + "\nesac\n"
+  dispatch_path = _write_unique(log_dir, "xsub_array_dispatch_", dispatch)
+  rendered = scheduler.parent_script(parameters, dispatch_path, scripts[0][1])
+  return _write_unique(log_dir, "xsub_array_", rendered)
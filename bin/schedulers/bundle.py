@@ -0,0 +1,217 @@
+import os,json,math,shlex,tempfile,pathlib,contextlib
+from typing import List,Tuple,Dict,Callable,Optional
+
+# Bundling of many small jobs into a single allocation of the scheduler, enabled by XSUB_BUNDLE_SIZE (> 1).
+# `xsub --batch` packs up to XSUB_BUNDLE_SIZE jobs having identical parameters into a bundle. The parameters describe
+# a single run. The allocation gets the resources of `width` runs on a single node, and the walltime of the runs
+# times the number of waves, and `xsub_bundle_run` executes `width` runs at a time on it.
+# The width is XSUB_BUNDLE_WIDTH if it is set, or as many runs as fit in a node: `max_mpi_procs_per_node` processes
+# on Fugaku, or XSUB_BUNDLE_NODE_CORES cores (the CPUs of the submitting host by default) on the others.
+# Each run gets an id like "bundle-<job id of the allocation>-<index>". Its state is kept in a file in the bundle
+# directory (created in the log directory), and it is cancelled by creating a marker file next to it.
+#
+# files in a bundle directory:
+#   manifest.json        runs (parent script and work directory), the number of concurrent runs, and cores per run
+#   run.sh               the job script of the allocation, which starts xsub_bundle_run
+#   <index>.status       "running <pid>" or "finished <rc|cancelled|terminated>". Absent while waiting in the bundle.
+#   <index>.cancel       requests the cancellation of the run
+#   <index>.log          stdout and stderr of the run
+
+PREFIX = "bundle-"
+RUNNER = pathlib.Path(__file__).resolve().parent.parent.joinpath("xsub_bundle_run")
+
+# keys of the walltime in the parameters of the schedulers, like "24:00:00"
+WALLTIME_KEYS = ("walltime", "elapse")
+
+def size() -> int:
+  return int(os.environ.get('XSUB_BUNDLE_SIZE') or 0)
+
+def enabled() -> bool:
+  return size() > 1
+
+def node_cores() -> int:
+  return int(os.environ.get('XSUB_BUNDLE_NODE_CORES') or os.cpu_count() or 1)
+
+def _index_dir() -> pathlib.Path:
+  # maps the job id of an allocation to its bundle directory
+  d = os.environ.get('XSUB_BUNDLE_INDEX') or os.path.join(os.path.expanduser('~'), '.xsub', 'bundles')
+  return pathlib.Path(d)
+
+def _index_path(allocation_id: str) -> pathlib.Path:
+  xsub_type = os.environ.get('XSUB_TYPE', '').lower()
+  return _index_dir().joinpath(f"{xsub_type}_{allocation_id.replace('/', '_')}")
+
+def _nodes(parameters: dict) -> int:
+  # nodes of a job, computed as the parent scripts of the schedulers do
+  if "node" in parameters:
+    return math.prod(int(n) for n in str(parameters["node"]).split('x'))
+  if "ppn" in parameters:
+    return -(-int(parameters["mpi_procs"]) * int(parameters["omp_threads"]) // int(parameters["ppn"]))
+  return 1
+
+def _width(parameters: dict, runs: int) -> int:
+  # number of concurrent runs
+  mpi = int(parameters.get("mpi_procs", 1))
+  if os.environ.get('XSUB_BUNDLE_WIDTH'):
+    width = int(os.environ['XSUB_BUNDLE_WIDTH'])
+  elif "max_mpi_procs_per_node" in parameters:
+    width = int(parameters["max_mpi_procs_per_node"]) // mpi
+  else:
+    width = node_cores() // (mpi * int(parameters.get("omp_threads", 1)))
+  return max(1, min(width, runs))
+
+def _scale_time(walltime: str, factor: int) -> str:
+  # "1:30:00" * 3 -> "4:30:00"
+  h, m, s = (int(x) for x in str(walltime).split(':'))
+  t = (h * 3600 + m * 60 + s) * factor
+  return f"{t // 3600}:{t % 3600 // 60:02d}:{t % 60:02d}"
+
+def allocation(parameters: dict, runs: int) -> Tuple[dict,int]:
+  # the parameters of the allocation running `runs` jobs of `parameters`, and the number of concurrent runs
+  width = _width(parameters, runs)
+  mpi, omp = int(parameters.get("mpi_procs", 1)), int(parameters.get("omp_threads", 1))
+  alloc = dict(parameters, mpi_procs=mpi * width)
+  if "ppn" in parameters:
+    alloc["ppn"] = mpi * omp * width   # all the processes on one node
+  waves = -(-runs // width)
+  for key in WALLTIME_KEYS:
+    if key in parameters:
+      alloc[key] = _scale_time(parameters[key], waves)
+  return (alloc, width)
+
+def submit(scheduler, scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, log, parameters: dict) -> Tuple[List[str],str]:
+  # `scripts` is a list of (parent script, work dir). Returns the ids of the runs and the output of the submission.
+  if _nodes(parameters) > 1:
+    # the runner starts the runs on the node of the job script, so the other nodes would be left idle
+    raise Exception(f"a job in a bundle must fit in a single node, but the parameters request {_nodes(parameters)} nodes")
+  alloc, width = allocation(parameters, len(scripts))
+  scheduler.validate_parameters(alloc)
+  d = pathlib.Path(tempfile.mkdtemp(prefix="xsub_bundle_", dir=log_dir))
+  manifest = {
+    "width": width,
+    "cores_per_run": int(parameters.get("mpi_procs", 1)) * int(parameters.get("omp_threads", 1)),
+    "runs": [{"parent_script": str(ps.absolute()), "work_dir": str(wd.absolute())} for (ps,wd) in scripts]
+  }
+  with open(d.joinpath("manifest.json"), mode='w') as f:
+    json.dump(manifest, f)
+  run_script = d.joinpath("run.sh")
+  with open(run_script, mode='w') as f:
+    f.write(f"python3 {shlex.quote(str(RUNNER))} {shlex.quote(str(d))}\n")
+  parent_script = d.joinpath("xsub_bundle.sh")
+  with open(parent_script, mode='w') as f:
+    f.write(scheduler.parent_script(alloc, run_script, d))
+  log.event("bundle", runs=len(scripts), bundle_dir=str(d))
+  job_id, raw_output = scheduler.submit_job(parent_script, d, log_dir, log, alloc)
+  os.makedirs(_index_dir(), exist_ok=True)
+  with open(_index_path(job_id), mode='w') as f:
+    f.write(str(d))
+  return ([f"{PREFIX}{job_id}-{i}" for i in range(len(scripts))], raw_output)
+
+def _parse(job_id: str):
+  # "bundle-1234.server-5" -> ("1234.server", 5)
+  if not job_id.startswith(PREFIX):
+    return None
+  allocation_id, _, idx = job_id[len(PREFIX):].rpartition('-')
+  return (allocation_id, int(idx)) if allocation_id and idx.isdigit() else None
+
+def _bundle_dir(allocation_id: str):
+  try:
+    with open(_index_path(allocation_id)) as f:
+      return pathlib.Path(f.read().strip())
+  except OSError:
+    return None
+
+def _ended_marker(allocation_id: str) -> pathlib.Path:
+  # created when the allocation is seen finished for the first time while some runs are not finished
+  p = _index_path(allocation_id)
+  return p.with_name(p.name + ".ended")
+
+def _forget(allocation_id: str) -> None:
+  # the index entry of a finished allocation is not needed any more. Its runs are reported finished without it.
+  for p in (_index_path(allocation_id), _ended_marker(allocation_id)):
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(p)
+
+def _allocation_ended(allocation_id: str, d: pathlib.Path) -> None:
+  # forgets the allocation once all of its runs are finished, or at the second reading of "finished".
+  # a single reading may be wrong, e.g. when the job just left the queue listing of a slow server.
+  with open(d.joinpath("manifest.json")) as f:
+    n = len(json.load(f)["runs"])
+  marker = _ended_marker(allocation_id)
+  if all(_run_state(d, i).startswith("finished") for i in range(n)) or marker.exists():
+    _forget(allocation_id)
+  else:
+    marker.touch()
+
+def _run_state(d: pathlib.Path, idx: int) -> str:
+  try:
+    with open(d.joinpath(f"{idx}.status")) as f:
+      return f.read().strip()
+  except OSError:
+    return ""
+
+def multiple_status(scheduler, job_ids: List[str], query: Callable) -> Dict[str,Tuple[str,str]]:
+  # same as `query(scheduler, job_ids)`, but the state of a run in a bundle is combined from its state file
+  # and the state of the allocation
+  runs = {j: _parse(j) for j in job_ids if _parse(j)}
+  allocations = list(dict.fromkeys(a for (a,_) in runs.values()))
+  to_query = [j for j in job_ids if j not in runs] + allocations
+  results = query(scheduler, to_query) if to_query else {}
+  output = {}
+  ended = {}
+  for job_id in job_ids:
+    if job_id not in runs:
+      output[job_id] = results[job_id]
+      continue
+    allocation_id, idx = runs[job_id]
+    d = _bundle_dir(allocation_id)
+    if d is None:
+      output[job_id] = ("finished", f"bundle {allocation_id} is finished or not found")
+      continue
+    alloc_status, alloc_raw = results[allocation_id]
+    state = _run_state(d, idx)
+    raw_output = f"{job_id}: {state or 'waiting'} in {d}\n{alloc_raw}"
+    if state.startswith("finished"):
+      output[job_id] = ("finished", raw_output)
+    elif alloc_status == "finished":
+      output[job_id] = ("finished", f"{job_id}: the allocation ended before the run finished\n{alloc_raw}")
+    elif state.startswith("running"):
+      output[job_id] = ("running", raw_output)
+    else:
+      output[job_id] = ("queued", raw_output)
+    if alloc_status == "finished":
+      ended[allocation_id] = d
+    else:
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(_ended_marker(allocation_id))
+  for (allocation_id,d) in ended.items():
+    _allocation_ended(allocation_id, d)
+  return output
+
+def delete_multiple(scheduler, job_ids: List[str], delete: Callable) -> Dict[str,dict]:
+  # same as `delete(scheduler, job_ids)`, but a run in a bundle is cancelled by its marker file.
+  # the allocation itself is cancelled once all of its runs are finished or cancelled.
+  runs = {j: _parse(j) for j in job_ids if _parse(j)}
+  if not runs:
+    return delete(scheduler, job_ids)
+  output = {}
+  touched = {}
+  for (job_id,(allocation_id,idx)) in runs.items():
+    d = _bundle_dir(allocation_id)
+    if d is None or _run_state(d, idx).startswith("finished"):
+      output[job_id] = {"result": "finished", "raw_output": f"job is already finished or does not exist: {job_id}"}
+      continue
+    open(d.joinpath(f"{idx}.cancel"), mode='a').close()
+    output[job_id] = {"result": "deleted", "raw_output": f"{job_id} is cancelled"}
+    touched[allocation_id] = d
+  to_delete = [j for j in job_ids if j not in runs]
+  for (allocation_id,d) in touched.items():
+    with open(d.joinpath("manifest.json")) as f:
+      n = len(json.load(f)["runs"])
+    if all(d.joinpath(f"{i}.cancel").exists() or _run_state(d, i).startswith("finished") for i in range(n)):
+      to_delete.append(allocation_id)
+  deleted = delete(scheduler, to_delete) if to_delete else {}
+  for job_id in job_ids:
+    if job_id not in output:
+      output[job_id] = deleted[job_id]
+  return {job_id: output[job_id] for job_id in job_ids}
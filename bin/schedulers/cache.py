@@ -0,0 +1,111 @@
+import os,json,time,fcntl,getpass,pathlib,threading,contextlib
+from typing import Dict,Tuple,Callable,Optional
+from . import context
+
+# Opt-in on-disk cache of the parsed queue snapshot, shared by concurrent xstat/xdel processes.
+# It is enabled by setting XSUB_STATUS_CACHE_TTL to a positive number of seconds.
+# The snapshot is guarded by a lock file, so only one process queries the scheduler per interval.
+
+_bypass = False
+
+def bypass() -> None:
+  # always query the scheduler in this process. The fresh snapshot is still stored for the others.
+  global _bypass
+  _bypass = True
+
+def ttl() -> float:
+  return float(os.environ.get('XSUB_STATUS_CACHE_TTL') or 0)
+
+# A Session keeps the snapshots in memory and reuses them for its following calls, without the shared cache.
+# The store is bound to the thread running the session's call, so sessions in other threads are not affected.
+_local = threading.local()
+
+@contextlib.contextmanager
+def in_memory(store: dict, ttl: float):
+  # snapshots taken in the block are kept in `store` as {path: (time, index)}, and are reused for `ttl` seconds
+  saved = memory()
+  if ttl > 0:
+    _local.memory = (store, ttl)
+  try:
+    yield
+  finally:
+    _local.memory = saved
+
+def memory() -> Optional[Tuple[dict,float]]:
+  # (store, ttl) of the current thread, to be handed over to worker threads
+  return getattr(_local, "memory", None)
+
+def enabled() -> bool:
+  # whether the status queries are answered from a snapshot of the whole queue
+  return ttl() > 0 or memory() is not None
+
+def cache_dir() -> pathlib.Path:
+  d = os.environ.get('XSUB_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.xsub', 'cache')
+  return pathlib.Path(d)
+
+def _path(scheduler_type: str) -> pathlib.Path:
+  if context.backend_name():
+    scheduler_type = f"{context.backend_name()}_{scheduler_type}"   # backends of the same type have separate snapshots
+  return cache_dir().joinpath(f"status_{scheduler_type}_{getpass.getuser()}.json")
+
+@contextlib.contextmanager
+def _locked(path: pathlib.Path):
+  os.makedirs(path.parent, exist_ok=True)
+  with open(path.with_suffix('.lock'), mode='a') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _load(path: pathlib.Path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def _store(path: pathlib.Path, index: Dict[str,str], fetched_at: float) -> None:
+  tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+  with open(tmp, mode='w') as f:
+    json.dump({"time": fetched_at, "index": index}, f)
+  os.replace(tmp, path)
+
+def snapshot(scheduler_type: str, fetch: Callable[[],Dict[str,str]]) -> Tuple[Dict[str,str],float]:
+  # the index of the whole queue, and the time when it was fetched
+  path = _path(scheduler_type)
+  mem = memory()
+  if mem is not None and not _bypass:
+    kept = mem[0].get(str(path))
+    if kept and 0 <= time.time() - kept[0] < mem[1]:
+      return (kept[1], kept[0])
+  index, fetched_at = _shared_snapshot(path, fetch)
+  if mem is not None:
+    mem[0][str(path)] = (fetched_at, index)
+  return (index, fetched_at)
+
+def _shared_snapshot(path: pathlib.Path, fetch: Callable[[],Dict[str,str]]) -> Tuple[Dict[str,str],float]:
+  t = ttl()
+  if t <= 0:
+    fetched_at = time.time()
+    return (fetch(), fetched_at)
+  with _locked(path):
+    if not _bypass:
+      data = _load(path)
+      if data and 0 <= time.time() - data["time"] < t:
+        return (data["index"], data["time"])
+    fetched_at = time.time()
+    index = fetch()
+    _store(path, index, fetched_at)
+    return (index, fetched_at)
+
+def invalidate(scheduler_type: str) -> None:
+  # called after a job is submitted or deleted so that the next caller sees the change
+  path = _path(scheduler_type)
+  if memory() is not None:
+    memory()[0].pop(str(path), None)
+  if ttl() <= 0:
+    return
+  with _locked(path):
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(path)
@@ -0,0 +1,49 @@
+import os,pathlib,threading,contextlib
+from typing import Optional
+
+# The environment that the current thread is working in, when it differs from that of the process:
+# - a backend of the "multi" scheduler. The scheduler commands run in a backend get its environment
+#   (e.g. PATH or the address of its server), and the status cache is kept separately for each backend.
+# - a client of xsubd. Its request is served with the environment and working directory of the client.
+# Otherwise, everything is as usual.
+
+_local = threading.local()
+
+@contextlib.contextmanager
+def backend(name: str, xsub_type: str, env: Optional[dict] = None):
+  saved = getattr(_local, "backend", None)
+  _local.backend = (name, dict(environ() or os.environ, XSUB_TYPE=xsub_type, **(env or {})))
+  try:
+    yield
+  finally:
+    _local.backend = saved
+
+@contextlib.contextmanager
+def client(env: dict, cwd: str):
+  saved = getattr(_local, "client", None)
+  _local.client = (env, cwd)
+  try:
+    yield
+  finally:
+    _local.client = saved
+
+def backend_name() -> Optional[str]:
+  b = getattr(_local, "backend", None)
+  return b[0] if b else None
+
+def environ() -> Optional[dict]:
+  # the environment of the commands, or None to inherit that of the process
+  b = getattr(_local, "backend", None)
+  if b:
+    return b[1]
+  c = getattr(_local, "client", None)
+  return c[0] if c else None
+
+def cwd() -> Optional[str]:
+  # the working directory of the commands, or None for that of the process
+  c = getattr(_local, "client", None)
+  return c[1] if c else None
+
+def absolute(path) -> pathlib.Path:
+  # `path` made absolute against the working directory of the thread
+  return pathlib.Path(cwd() or os.getcwd()).joinpath(path)
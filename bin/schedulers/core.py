@@ -0,0 +1,334 @@
+import json,re,time,pathlib,os,hashlib
+from typing import List,Tuple,Dict
+from . import registry,trace,spool,bundle,eventlog,context
+
+# Operations behind the xsub, xstat, and xdel commands.
+# They are shared by Session (session.py) and xsubd, and return the objects that the commands print as JSON.
+
+_formats = {}
+
+def compiled_formats(scheduler) -> Dict[str,re.Pattern]:
+  # the formats of PARAMETERS are compiled once for each scheduler
+  if scheduler not in _formats:
+    _formats[scheduler] = {key: re.compile(d["format"]) for (key,d) in scheduler.PARAMETERS.items() if "format" in d}
+  return _formats[scheduler]
+
+def verify_parameters(parameters, scheduler):
+  formats = compiled_formats(scheduler)
+  params = dict(parameters)
+  # merge default parameters
+  for (key,definition) in scheduler.PARAMETERS.items():
+    if not key in parameters:
+      params[key] = definition["default"]
+
+  # verify there is no unknown key
+  unknown_keys = set(params.keys()) - set(scheduler.PARAMETERS)
+  if unknown_keys:
+    raise Exception(f"unknown keys {unknown_keys} exist")
+
+  # verify parameter format
+  for (key,definition) in scheduler.PARAMETERS.items():
+    if key in formats:
+      if not formats[key].match(str(params[key])):
+        raise Exception(f"invalid parameter format: {key} {params[key]} {definition['format']}")
+      if "options" in definition:
+        if not params[key] in definition["options"]:
+          raise Exception(f"invalid parameter value: {key} {params[key]} {definition['options']}")
+
+  # scheduler-specific validation of parameters
+  scheduler.validate_parameters(params)
+  return params
+
+
+# XSUB_SCRIPT_LAYOUT selects where parent scripts are written
+#   flat (default): <work_dir>/<stem>_xsub.sh, <stem>_xsub1.sh, ...
+#   sharded:        <work_dir>/xsub_scripts/<index // 1000>/<stem>_xsub<index>.sh, to keep directories small
+#   hash:           <XSUB_SCRIPT_STORE>/<sha256[:2]>/<sha256>.sh, so identical scripts are stored once
+SHARD_SIZE = 1000
+
+def prepare_parent_script(job_file, work_dir, parameters, scheduler):
+  rendered = scheduler.parent_script(parameters, job_file, work_dir)
+  layout = os.environ.get('XSUB_SCRIPT_LAYOUT') or 'flat'
+  if layout == 'hash':
+    return _store_by_hash(rendered)
+  elif layout == 'sharded':
+    return _create_numbered(work_dir.joinpath("xsub_scripts"), job_file.stem, rendered, sharded=True)
+  elif layout == 'flat':
+    return _create_numbered(work_dir, job_file.stem, rendered, sharded=False)
+  else:
+    raise Exception(f"unknown XSUB_SCRIPT_LAYOUT: {layout}")
+
+def _create_numbered(directory: pathlib.Path, stem: str, rendered: str, sharded: bool) -> pathlib.Path:
+  # the first script of a name is created directly. For the later ones, the next index is kept in a counter file,
+  # so a name is found in a few file operations instead of probing every index. The counter is only a hint:
+  # O_EXCL keeps the creation safe against concurrent submissions and against scripts left by older versions,
+  # which are skipped with doubling steps. So it needs no lock, which some shared filesystems do not support.
+  counter = directory.joinpath(f".{stem}_xsub.seq")
+  idx, step = 0, 1
+  while True:
+    name = f"{stem}_xsub.sh" if idx == 0 else f"{stem}_xsub{idx}.sh"
+    ps_path = directory.joinpath(str(idx // SHARD_SIZE), name) if sharded else directory.joinpath(name)
+    try:
+      fd = os.open(ps_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+      break
+    except FileExistsError:
+      if idx == 0:
+        idx = max(1, _read_counter(counter))
+      else:
+        idx += step
+        step *= 2
+    except FileNotFoundError:
+      os.makedirs(ps_path.parent, exist_ok=True)   # a new directory or shard
+  if idx > 0:
+    try:
+      with open(counter, mode='w') as f:
+        f.write(str(idx + 1))
+    except OSError:
+      pass   # the next submission probes from an older index
+  with os.fdopen(fd, mode='w') as f:
+    f.write(rendered)
+  return ps_path
+
+def _read_counter(counter: pathlib.Path) -> int:
+  try:
+    with open(counter) as f:
+      return int(f.read().strip() or 0)
+  except (OSError, ValueError):
+    return 0   # missing, or read while another submission rewrites it
+
+def _store_by_hash(rendered: str) -> pathlib.Path:
+  digest = hashlib.sha256(rendered.encode()).hexdigest()
+  store = pathlib.Path(os.environ.get('XSUB_SCRIPT_STORE') or os.path.join(os.path.expanduser('~'), '.xsub', 'scripts'))
+  ps_path = store.joinpath(digest[:2], f"{digest}.sh")
+  if ps_path.exists():
+    return ps_path
+  os.makedirs(ps_path.parent, exist_ok=True)
+  # a concurrent writer of the same script writes the same content, so the last rename wins harmlessly
+  tmp = ps_path.with_name(f"{ps_path.name}.{os.getpid()}.tmp")
+  with open(tmp, mode='w') as f:
+    f.write(rendered)
+  os.replace(tmp, ps_path)
+  return ps_path
+
+
+def template(scheduler) -> dict:
+  return {
+    "parameters": scheduler.PARAMETERS,
+  }
+
+
+def submit(scheduler, job_script: str, work_dir: str, log_dir: str, parameters: dict) -> dict:
+  with trace.phase("verify_parameters"):
+    parameters = verify_parameters(parameters, scheduler)
+  job_file = context.absolute(job_script)
+  work_dir = context.absolute(work_dir)
+  log_dir  = context.absolute(log_dir)
+
+  os.makedirs(work_dir, exist_ok=True)
+  os.makedirs(log_dir, exist_ok=True)
+
+  with trace.phase("parent_script"):
+    ps_path = prepare_parent_script(job_file, work_dir, parameters, scheduler)
+  if spool.enabled():
+    with trace.phase("spool"):
+      result = spool.submit(scheduler, [{"parent_script": ps_path, "work_dir": work_dir, "log_dir": log_dir, "parameters": parameters}])[0]
+    if "error" in result:
+      raise Exception(result["error"])
+    return {
+      "job_id": result["job_id"],
+      "raw_output": [l.rstrip() for l in result["raw_output"].splitlines()],
+      "parent_script": str(ps_path)
+    }
+  job = {"parent_script": ps_path, "work_dir": work_dir}
+  started = time.time()
+  with eventlog.open_log(log_dir) as log, trace.phase("submit_job"):
+    try:
+      job_id, raw_output = scheduler.submit_job(ps_path, work_dir, log_dir, log, parameters)
+    except Exception as e:
+      _log_submission(log, dict(job, error=str(e)), started)
+      raise
+    _log_submission(log, dict(job, job_id=job_id), started)
+  with trace.phase("registry"):
+    registry.record([{"job_id": job_id, "parent_script": ps_path, "work_dir": work_dir, "log_dir": log_dir, "parameters": parameters}])
+  return {
+    "job_id": job_id,
+    "raw_output": [l.rstrip() for l in raw_output.splitlines()],
+    "parent_script": str(ps_path)
+  }
+
+
+# maximum number of jobs submitted as a single job array
+MAX_ARRAY_SIZE = int(os.environ.get('XSUB_MAX_ARRAY_SIZE') or 1000)
+
+def read_batch(lines, name: str) -> List[dict]:
+  # each line is a JSON object like {"job_script": "run.sh", "dir": "work", "log": "log", "parameters": {...}}
+  # relative paths are resolved here, against the current directory of the caller
+  entries = []
+  for (lineno,line) in enumerate(lines, 1):
+    if not line.strip():
+      continue
+    try:
+      entries.append(resolve_entry(json.loads(line)))
+    except Exception as e:
+      raise Exception(f"invalid entry at line {lineno} of {name}: {e}")
+  return entries
+
+def resolve_entry(entry: dict) -> dict:
+  # fills the defaults of an entry of a batch and resolves its relative paths
+  return {
+    "job_script": str(context.absolute(entry["job_script"])),
+    "dir": str(context.absolute(entry.get("dir", "."))),
+    "log": str(context.absolute(entry.get("log", "."))),
+    "parameters": entry.get("parameters", {})
+  }
+
+def submit_batch(scheduler, entries: List[dict]) -> List[dict]:
+  # all the entries are verified before any job is submitted
+  jobs = []
+  with trace.phase("verify_parameters", jobs=len(entries)):
+    for (i,entry) in enumerate(entries):
+      try:
+        parameters = verify_parameters(entry["parameters"], scheduler)
+      except Exception as e:
+        raise Exception(f"invalid entry {i}: {e}")
+      jobs.append({
+        "job_file": context.absolute(entry["job_script"]),
+        "work_dir": context.absolute(entry["dir"]),
+        "log_dir": context.absolute(entry["log"]),
+        "parameters": parameters
+      })
+
+  with trace.phase("parent_script", jobs=len(jobs)):
+    for job in jobs:
+      os.makedirs(job["work_dir"], exist_ok=True)
+      os.makedirs(job["log_dir"], exist_ok=True)
+      job["parent_script"] = prepare_parent_script(job["job_file"], job["work_dir"], job["parameters"], scheduler)
+
+  if spool.enabled():
+    # jobs are submitted one by one from the spool, in the order of the input
+    with trace.phase("spool", jobs=len(jobs)):
+      for (job,result) in zip(jobs, spool.submit(scheduler, jobs)):
+        job.update(result)
+    return _batch_outputs(jobs)
+
+  # jobs with identical parameters are bundled into a single allocation if XSUB_BUNDLE_SIZE is set,
+  # or else submitted as a job array if the scheduler supports it
+  groups = {}
+  for job in jobs:
+    key = (json.dumps(job["parameters"], sort_keys=True), str(job["log_dir"]))
+    groups.setdefault(key, []).append(job)
+  use_bundle = bundle.enabled()
+  use_array = hasattr(scheduler, "submit_array")
+  chunk_size = bundle.size() if use_bundle else (MAX_ARRAY_SIZE if use_array else 1)
+  for group in groups.values():
+    log_dir = group[0]["log_dir"]
+    for i in range(0, len(group), chunk_size):
+      chunk = group[i:i+chunk_size]
+      phase = "submit_job" if len(chunk) == 1 else ("submit_bundle" if use_bundle else "submit_array")
+      started = time.time()
+      with eventlog.open_log(log_dir) as log, trace.phase(phase, jobs=len(chunk)):
+        try:
+          if len(chunk) > 1:
+            scripts = [(job["parent_script"], job["work_dir"]) for job in chunk]
+            if use_bundle:
+              job_ids, raw_output = bundle.submit(scheduler, scripts, log_dir, log, chunk[0]["parameters"])
+            else:
+              job_ids, raw_output = scheduler.submit_array(scripts, log_dir, log, chunk[0]["parameters"])
+            for (job,job_id) in zip(chunk, job_ids):
+              job["job_id"], job["raw_output"] = job_id, raw_output
+          else:
+            job = chunk[0]
+            job["job_id"], job["raw_output"] = scheduler.submit_job(job["parent_script"], job["work_dir"], log_dir, log, job["parameters"])
+        except Exception as e:
+          for job in chunk:
+            job["error"] = str(e)
+        for job in chunk:
+          _log_submission(log, job, started)
+
+  with trace.phase("registry", jobs=len(jobs)):
+    registry.record([job for job in jobs if "job_id" in job])
+  return _batch_outputs(jobs)
+
+def _log_submission(log, job: dict, started: float) -> None:
+  # one "submitted" or "failed" event per job in xsub.log of the log directory
+  fields = {"parent_script": str(job["parent_script"]), "work_dir": str(job["work_dir"]), "duration_s": round(time.time() - started, 3)}
+  if "error" in job:
+    log.event("failed", error=job["error"], **fields)
+  else:
+    log.event("submitted", job_id=job["job_id"], **fields)
+
+def _batch_outputs(jobs: List[dict]) -> List[dict]:
+  # one result per job in the order of the input
+  outputs = []
+  for job in jobs:
+    if "error" in job:
+      outputs.append({"error": job["error"], "parent_script": str(job["parent_script"])})
+    else:
+      outputs.append({
+        "job_id": job["job_id"],
+        "raw_output": [l.rstrip() for l in job["raw_output"].splitlines()],
+        "parent_script": str(job["parent_script"])
+      })
+  return outputs
+
+
+# spooled jobs and runs in bundles have local ids, which are resolved before the scheduler is queried
+def _query(scheduler, job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+  return bundle.multiple_status(scheduler, job_ids, registry.multiple_status)
+
+def _delete(scheduler, job_ids: List[str]) -> dict:
+  return bundle.delete_multiple(scheduler, job_ids, _delete_multiple)
+
+def multiple_status(scheduler, job_ids: List[str]) -> dict:
+  with trace.phase("multiple_status", ids=len(job_ids)):
+    result = spool.multiple_status(scheduler, job_ids, _query)
+  output = {}
+  for (k,v) in result.items():
+    output[k] = {"status": v[0], "raw_output": v[1]}
+  return output
+
+def status(scheduler, job_id: str) -> dict:
+  with trace.phase("multiple_status", ids=1):
+    status,raw_output = spool.multiple_status(scheduler, [job_id], _query)[job_id]
+  return {"status": status, "raw_output": raw_output}
+
+
+def delete(scheduler, job_id: str) -> Tuple[str,str]:
+  # returns (stdout, stderr) of xdel
+  if job_id.startswith((spool.PREFIX, bundle.PREFIX)):
+    r = delete_multiple(scheduler, [job_id])[job_id]
+    return (r["raw_output"], "") if r["result"] == "deleted" else ("", r["raw_output"])
+  with trace.phase("multiple_status", ids=1):
+    stat = registry.multiple_status(scheduler, [job_id])[job_id][0]
+  if stat == "finished":
+    return ("", f"job is already finished or does not exist: {job_id}")
+  with trace.phase("delete", ids=1):
+    return (scheduler.delete(job_id), "")
+
+def delete_multiple(scheduler, job_ids: List[str]) -> dict:
+  return spool.delete_multiple(scheduler, list(dict.fromkeys(job_ids)), _delete)
+
+def _delete_multiple(scheduler, job_ids: List[str]) -> dict:
+  # a single status query, then as few cancel commands as possible for the jobs that are still alive
+  job_ids = list(dict.fromkeys(job_ids))
+  with trace.phase("multiple_status", ids=len(job_ids)):
+    stats = registry.multiple_status(scheduler, job_ids)
+  alive = [job_id for job_id in job_ids if stats[job_id][0] != "finished"]
+  with trace.phase("delete", ids=len(alive)):
+    if hasattr(scheduler, "delete_multiple"):
+      deleted = scheduler.delete_multiple(alive) if alive else {}
+    else:
+      deleted = {}
+      for job_id in alive:
+        try:
+          deleted[job_id] = ("deleted", scheduler.delete(job_id))
+        except Exception as e:
+          deleted[job_id] = ("error", str(e))
+  output = {}
+  for job_id in job_ids:
+    if job_id in deleted:
+      result, raw_output = deleted[job_id]
+    else:
+      result, raw_output = ("finished", f"job is already finished or does not exist: {job_id}")
+    output[job_id] = {"result": result, "raw_output": raw_output}
+  return output
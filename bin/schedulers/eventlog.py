@@ -0,0 +1,101 @@
+import os,json,time,fcntl,pathlib,contextlib
+
+# Structured log of the submissions, written to <log_dir>/xsub.log as JSON lines like
+#   {"time": 1700000000.0, "pid": 1234, "event": "submitted", "job_id": "5678", ...}
+# Each record is written by a single write(2) on a file opened with O_APPEND, so records of concurrent writers never
+# interleave. When the file exceeds XSUB_LOG_MAX_BYTES (10 MiB by default), it is rotated to xsub.log.1, xsub.log.2, ...
+# keeping XSUB_LOG_BACKUPS (3 by default) old files. The output of the jobs is written to separate files.
+
+class EventLog:
+
+  def __init__(self, path: pathlib.Path):
+    self.path = path
+    self._fd = None
+    self._partial = ""
+
+  def _open(self) -> None:
+    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+
+  def close(self) -> None:
+    if self._partial:
+      self.event("message", text=self._partial)
+      self._partial = ""
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def event(self, name: str, **fields) -> None:
+    record = dict({"time": time.time(), "pid": os.getpid(), "event": name}, **fields)
+    self._append((json.dumps(record, default=str) + "\n").encode())
+
+  def command(self, argv, returncode: int, duration: float, **fields) -> None:
+    self.event("command", argv=list(argv), returncode=returncode, duration_s=round(duration, 3), **fields)
+
+  def write(self, text: str) -> int:
+    # free-form text (e.g. of a scheduler plugin written for the text log) is recorded as "message" events line by line
+    self._partial += text
+    *lines, self._partial = self._partial.split("\n")
+    for line in lines:
+      if line.strip():
+        self.event("message", text=line)
+    return len(text)
+
+  def flush(self) -> None:
+    pass
+
+  def _append(self, data: bytes) -> None:
+    if self._fd is None:
+      self._open()
+    elif self._moved():
+      # another writer has rotated the file, so the fd points at xsub.log.1
+      os.close(self._fd)
+      self._open()
+    if os.fstat(self._fd).st_size + len(data) > max_bytes():
+      self._rotate()
+    os.write(self._fd, data)
+
+  def _moved(self) -> bool:
+    try:
+      current = os.stat(self.path)
+    except FileNotFoundError:
+      return True
+    mine = os.fstat(self._fd)
+    return (current.st_ino, current.st_dev) != (mine.st_ino, mine.st_dev)
+
+  def _rotate(self) -> None:
+    with open(self.path.with_name(self.path.name + ".lock"), mode='a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        # another process may have rotated the file already. Then the current file is simply reopened.
+        try:
+          current = os.stat(self.path)
+        except FileNotFoundError:
+          current = None
+        mine = os.fstat(self._fd)
+        if current is not None and (current.st_ino, current.st_dev) == (mine.st_ino, mine.st_dev) and current.st_size > 0:
+          n = backups()
+          for i in range(n - 1, 0, -1):
+            with contextlib.suppress(FileNotFoundError):
+              os.replace(f"{self.path}.{i}", f"{self.path}.{i+1}")
+          if n > 0:
+            os.replace(self.path, f"{self.path}.1")
+          else:
+            os.remove(self.path)
+        os.close(self._fd)
+        self._open()
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+def max_bytes() -> int:
+  return int(os.environ.get('XSUB_LOG_MAX_BYTES') or 10*1024*1024)
+
+def backups() -> int:
+  return int(os.environ.get('XSUB_LOG_BACKUPS') or 3)
+
+@contextlib.contextmanager
+def open_log(log_dir: pathlib.Path):
+  log = EventLog(pathlib.Path(log_dir).joinpath("xsub.log"))
+  try:
+    yield log
+  finally:
+    log.close()
@@ -1,5 +1,6 @@
-import pathlib,io,subprocess,re,functools
-from typing import List,Tuple,Dict
+import pathlib,time,re,functools,shlex
+from typing import List,Tuple,Dict,Optional
+from . import status,cache,array,runner,eventlog
 
 class FugakuScheduler:
 
@@ -84,71 +85,110 @@ class FugakuScheduler:
     )
 
   @staticmethod
-  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: io.TextIOBase, parameters: dict) -> Tuple[str,str]:
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[str,str]:
     stdout_path = log_dir.joinpath('%j.o.txt')
     stderr_path = log_dir.joinpath('%j.e.txt')
     job_stat_path = log_dir.joinpath('%j.i.txt')
 
-    command = f"cd {work_dir.absolute()} && pjsub {script_path.absolute()} -o {stdout_path.absolute()} -e {stderr_path.absolute()} --spath {job_stat_path.absolute()} < /dev/null"
-    log.write(f"cmd: {command}\n")
-
-    result = subprocess.run(command, shell=True, check=False, stdout=subprocess.PIPE)
+    command = ["pjsub", str(script_path.absolute()), "-o", str(stdout_path.absolute()), "-e", str(stderr_path.absolute()), "--spath", str(job_stat_path.absolute())]
+    started = time.time()
+    result = runner.run(command, cwd=work_dir.absolute(), retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
     output = result.stdout.decode()
+    log.command(command, result.returncode, time.time() - started, cwd=str(work_dir.absolute()))
     if result.returncode != 0:
-      log.write(f"rc is not zero for {command}: {result.returncode}\n")
-      log.write(output)
-      raise Exception(f"rc is not zero for {command}")
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero for {shlex.join(command)}: {result.stderr.decode()}")
 
     pattern = re.compile(r"Job (\d+) submitted")
     matched = pattern.search(output)
     if not matched:
-      log.write(f"failed to get job_id:\n{output}\n")
+      log.event("error", message="failed to get job_id", output=output)
       raise Exception(f"failed to get job_id:\n{output}\n")
     job_id = matched.group(1)
 
-    log.write(f"job_id: {job_id}\n")
+    cache.invalidate("fugaku")
     return (job_id, output)
 
+  @staticmethod
+  def submit_array(scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[List[str],str]:
+    script_path = array.prepare_array_script(FugakuScheduler, scripts, log_dir, parameters, "PJM_BULKNUM")
+    stdout_path = log_dir.joinpath('%j.o.txt')
+    stderr_path = log_dir.joinpath('%j.e.txt')
+    job_stat_path = log_dir.joinpath('%j.i.txt')
+
+    command = ["pjsub", "--bulk", "--sparam", f"0-{len(scripts)-1}", str(script_path.absolute()), "-o", str(stdout_path.absolute()), "-e", str(stderr_path.absolute()), "--spath", str(job_stat_path.absolute())]
+    started = time.time()
+    result = runner.run(command, cwd=scripts[0][1].absolute(), retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
+    output = result.stdout.decode()
+    log.command(command, result.returncode, time.time() - started, cwd=str(scripts[0][1].absolute()))
+    if result.returncode != 0:
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero for {shlex.join(command)}: {result.stderr.decode()}")
+
+    pattern = re.compile(r"Job (\d+) submitted")
+    matched = pattern.search(output)
+    if not matched:
+      log.event("error", message="failed to get job_id", output=output)
+      raise Exception(f"failed to get job_id:\n{output}\n")
+    bulk_id = matched.group(1)
+
+    cache.invalidate("fugaku")
+    return ([f"{bulk_id}[{i}]" for i in range(len(scripts))], output)
+
   @staticmethod
   def all_status() -> str:
-    cmd = 'pjstat --with-summary'
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+    result = runner.run(["pjstat", "--with-summary"], check=True)
     return result.stdout.decode()
 
   @staticmethod
   def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
-    result = subprocess.run("pjstat", shell=True, check=True, stdout=subprocess.PIPE)
-    output_list = result.stdout.decode().splitlines()
-
-    ret = {}
-    for job_id in job_ids:
-      pattern = re.compile(r'^\s*' + job_id)
-      matched = [line for line in output_list if pattern.match(line)]
-      if matched:
-        ret[job_id] = FugakuScheduler._parse_status(matched[-1])
-      else:
-        ret[job_id] = ("finished", "not found in pjstat")
-    return ret
+    index = status.query_index("fugaku", FugakuScheduler._queue_index, job_ids)
+    return status.lookup(job_ids, index, FugakuScheduler._parse_status, "not found in pjstat")
+
+  @staticmethod
+  def queue_depth() -> int:
+    return status.queue_depth("fugaku", FugakuScheduler._queue_index, FugakuScheduler._parse_status)
+
+  # error messages printed for ids that are no longer in the queue
+  _UNKNOWN_JOB = re.compile(r'not found|does not exist', re.IGNORECASE)
+
+  # only the job id and the state are printed. -E prints the subjobs of bulk jobs.
+  _QUEUE_FORMAT = ["-E", "--choose", "jid,st"]
+
+  @staticmethod
+  def _queue_index(job_ids: Optional[List[str]] = None) -> Dict[str,str]:
+    if job_ids is None:
+      result = runner.run(["pjstat"] + FugakuScheduler._QUEUE_FORMAT, check=True)
+      return status.index_lines(result.stdout.decode().splitlines())
+    index = {}
+    for chunk in status.chunks(job_ids):
+      cmd = ["pjstat"] + FugakuScheduler._QUEUE_FORMAT + chunk
+      output = status.run_query(cmd, FugakuScheduler._UNKNOWN_JOB)
+      index.update(status.index_lines(output.splitlines()))
+    return index
+
+  # values of "ST". A job in the queue with an unknown state is regarded as running.
+  _STATES = {
+    "ACC": "queued", "QUE": "queued", "HLD": "queued", "ERR": "queued",
+    "RNA": "running", "RNP": "running", "RUN": "running", "RNE": "running", "RNO": "running",
+    "SPP": "running", "SPD": "running", "RSM": "running", "SWO": "running", "SWD": "running", "SWI": "running",
+    "EXT": "finished", "RJT": "finished", "CCL": "finished"
+  }
 
   @staticmethod
   def _parse_status(line: str) -> Tuple[str,str]:
-    c = line.split()[3]
-
-    pq = re.compile(r'ACC|QUE')
-    pr = re.compile(r'RNA|RNP|RUN|RNE|RNO|SWO|SWD|SWI|HLD')
-    pf = re.compile(r'EXT|RJT|CCL')
-    if pq.match(c):
-      status = 'queued'
-    elif pr.match(c):
-      status = 'running'
-    elif pf.match(c):
-      status = 'finished'
-    else:
-      status = 'finished'
-    return (status, line)
+    cols = line.split()
+    c = cols[1] if len(cols) > 1 else ""
+    return (FugakuScheduler._STATES.get(c, "running"), line)
 
   @staticmethod
   def delete(job_id: str) -> str:
-    cmd = f"pjdel {job_id}"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+    result = runner.run(["pjdel", job_id], check=True)
+    cache.invalidate("fugaku")
     return result.stdout.decode()
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    results = status.run_cancel("pjdel", job_ids, FugakuScheduler._UNKNOWN_JOB)
+    cache.invalidate("fugaku")
+    return results
@@ -0,0 +1,200 @@
+import os,re,sys,json,time,pathlib,functools,threading,concurrent.futures
+from typing import List,Tuple,Dict,Callable
+from . import cache,context,load
+
+# Scheduler spreading the jobs over several backends (e.g. a Slurm cluster and Fugaku), selected by XSUB_TYPE=multi.
+# The backends are listed in ~/.xsub/multi.json (or XSUB_MULTI_CONFIG) like
+#   {"backends": {"hpc": {"type": "slurm"}, "fx": {"type": "fugaku", "env": {"PATH": "..."}, "weight": 4}}}
+# - job ids carry the name of the backend, like "hpc:1234".
+# - status queries and cancellations are sent to the backends concurrently, one thread for each backend.
+# - a job goes to the backend given by the "backend" parameter. If it is empty, the backend with the fewest
+#   jobs of the user in its queue per weight is chosen. The depths are taken from the status snapshots
+#   (see cache.py), and reused for XSUB_MULTI_ROUTE_TTL seconds within a process.
+# - "env" is added to the environment of the scheduler commands of the backend.
+
+SEPARATOR = ":"
+
+def config_path() -> pathlib.Path:
+  p = os.environ.get('XSUB_MULTI_CONFIG') or os.path.join(os.path.expanduser('~'), '.xsub', 'multi.json')
+  return pathlib.Path(p)
+
+def route_ttl() -> float:
+  return float(os.environ.get('XSUB_MULTI_ROUTE_TTL') or 10)
+
+def _load_backends() -> Dict[str,dict]:
+  try:
+    with open(config_path()) as f:
+      config = json.load(f)
+  except (OSError, ValueError) as e:
+    raise Exception(f"failed to load the backends of the multi scheduler from {config_path()}: {e}")
+  backends = {}
+  for (name,b) in config.get("backends", {}).items():
+    if not name or SEPARATOR in name:
+      raise Exception(f"invalid backend name '{name}'")
+    xsub_type = b.get("type", "").lower()
+    if xsub_type == "multi":
+      raise Exception(f"backend {name} must not be of type multi")
+    backends[name] = {"type": xsub_type, "env": b.get("env", {}), "weight": float(b.get("weight", 1)), "scheduler": load(xsub_type)}
+  if not backends:
+    raise Exception(f"no backend is defined in {config_path()}")
+  return backends
+
+def _parameters(backends: Dict[str,dict]) -> dict:
+  # union of the parameters of the backends. When the backends disagree on the format of a parameter,
+  # it is checked against the chosen backend in validate_parameters.
+  params = {"backend": {"description": "Backend to submit the job to. Empty for the least loaded one", "default": "", "format": r'^(' + "|".join(re.escape(n) for n in backends) + r')?$'}}
+  for b in backends.values():
+    for (key,definition) in b["scheduler"].PARAMETERS.items():
+      if key not in params:
+        params[key] = definition
+      elif params[key].get("format") != definition.get("format") or params[key].get("options") != definition.get("options"):
+        params[key] = {k: v for (k,v) in params[key].items() if k not in ("format", "options")}
+  return params
+
+_BACKENDS = _load_backends()
+
+class MultiScheduler:
+
+  PARAMETERS = _parameters(_BACKENDS)
+
+  # queue depth of each backend, and when it was taken
+  _depths = {}
+  _lock = threading.Lock()
+
+  @staticmethod
+  def validate_parameters(params: dict) -> None:
+    if not params["backend"]:
+      params["backend"] = MultiScheduler._route()
+    name = params["backend"]
+    scheduler = _BACKENDS[name]["scheduler"]
+    for (key,definition) in scheduler.PARAMETERS.items():
+      if "format" in definition and not re.match(definition["format"], str(params[key])):
+        raise Exception(f"invalid parameter format for backend {name}: {key} {params[key]} {definition['format']}")
+      if "options" in definition and not params[key] in definition["options"]:
+        raise Exception(f"invalid parameter value for backend {name}: {key} {params[key]} {definition['options']}")
+    MultiScheduler._call(name, lambda s: s.validate_parameters(params))
+
+  @staticmethod
+  def parent_script(parameters: dict, job_file: pathlib.Path, work_dir: pathlib.Path) -> str:
+    return MultiScheduler._call(parameters["backend"], lambda s: s.parent_script(parameters, job_file, work_dir))
+
+  @staticmethod
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log, parameters: dict) -> Tuple[str,str]:
+    name = parameters["backend"]
+    job_id, output = MultiScheduler._call(name, lambda s: s.submit_job(script_path, work_dir, log_dir, log, parameters))
+    return (f"{name}{SEPARATOR}{job_id}", output)
+
+  @staticmethod
+  def submit_array(scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, log, parameters: dict) -> Tuple[List[str],str]:
+    name = parameters["backend"]
+    def submit(s):
+      if hasattr(s, "submit_array"):
+        return s.submit_array(scripts, log_dir, log, parameters)
+      submitted = [s.submit_job(ps, wd, log_dir, log, parameters) for (ps,wd) in scripts]
+      return ([job_id for (job_id,_) in submitted], "".join(output for (_,output) in submitted))
+    job_ids, output = MultiScheduler._call(name, submit)
+    return ([f"{name}{SEPARATOR}{job_id}" for job_id in job_ids], output)
+
+  @staticmethod
+  def all_status() -> str:
+    results = MultiScheduler._fan_out({name: lambda s: s.all_status() for name in _BACKENDS})
+    return "".join(f"== {name} ({_BACKENDS[name]['type']}) ==\n{r}\n" for (name,r) in results.items())
+
+  @staticmethod
+  def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    groups, unknown = MultiScheduler._split(job_ids)
+    results = MultiScheduler._fan_out({name: functools.partial(lambda ids, s: s.multiple_status(ids), list(ids)) for (name,ids) in groups.items()})
+    output = {job_id: ("finished", f"unknown backend: {job_id}") for job_id in unknown}
+    for (name,ids) in groups.items():
+      MultiScheduler._raise_on_error(name, results[name])
+      for (local_id,job_id) in ids.items():
+        output[job_id] = results[name][local_id]
+    return {job_id: output[job_id] for job_id in job_ids}
+
+  @staticmethod
+  def delete(job_id: str) -> str:
+    groups, unknown = MultiScheduler._split([job_id])
+    if unknown:
+      raise Exception(f"unknown backend: {job_id}")
+    name, ids = next(iter(groups.items()))
+    return MultiScheduler._call(name, lambda s: s.delete(next(iter(ids))))
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    def delete(ids, s):
+      if hasattr(s, "delete_multiple"):
+        return s.delete_multiple(ids)
+      deleted = {}
+      for job_id in ids:
+        try:
+          deleted[job_id] = ("deleted", s.delete(job_id))
+        except Exception as e:
+          deleted[job_id] = ("error", str(e))
+      return deleted
+    groups, unknown = MultiScheduler._split(job_ids)
+    results = MultiScheduler._fan_out({name: functools.partial(delete, list(ids)) for (name,ids) in groups.items()})
+    output = {job_id: ("error", f"unknown backend: {job_id}") for job_id in unknown}
+    for (name,ids) in groups.items():
+      for (local_id,job_id) in ids.items():
+        output[job_id] = ("error", f"backend {name}: {results[name]}") if isinstance(results[name], Exception) else results[name][local_id]
+    return {job_id: output[job_id] for job_id in job_ids}
+
+  @staticmethod
+  def _split(job_ids: List[str]) -> Tuple[Dict[str,Dict[str,str]],List[str]]:
+    # "hpc:1234" -> {"hpc": {"1234": "hpc:1234"}}. Ids of unknown backends are returned separately.
+    groups, unknown = {}, []
+    for job_id in job_ids:
+      name, sep, local_id = job_id.partition(SEPARATOR)
+      if sep and name in _BACKENDS:
+        groups.setdefault(name, {})[local_id] = job_id
+      else:
+        unknown.append(job_id)
+    return (groups, unknown)
+
+  @staticmethod
+  def _call(name: str, f: Callable):
+    b = _BACKENDS[name]
+    with context.backend(name, b["type"], b["env"]):
+      return f(b["scheduler"])
+
+  @staticmethod
+  def _fan_out(calls: Dict[str,Callable]) -> dict:
+    # calls each backend in its own thread. A failure is returned as the Exception.
+    if not calls:
+      return {}
+    memory = cache.memory()   # the snapshots of a Session are shared with the worker threads
+    def call(name):
+      try:
+        with cache.in_memory(*(memory or ({}, 0))):
+          return MultiScheduler._call(name, calls[name])
+      except Exception as e:
+        return e
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(calls)) as executor:
+      return dict(zip(calls, executor.map(call, calls)))
+
+  @staticmethod
+  def _raise_on_error(name: str, result) -> None:
+    # a job of an unreachable backend must not be reported as finished
+    if isinstance(result, Exception):
+      raise Exception(f"backend {name}: {result}")
+
+  @staticmethod
+  def _route() -> str:
+    # the backend with the fewest queued and running jobs per weight. Backends without `queue_depth`
+    # or failing to answer are not chosen.
+    with MultiScheduler._lock:
+      now = time.time()
+      depths = MultiScheduler._depths
+      stale = [name for (name,b) in _BACKENDS.items() if hasattr(b["scheduler"], "queue_depth") and (name not in depths or now - depths[name][1] > route_ttl())]
+      for (name,depth) in MultiScheduler._fan_out({name: lambda s: s.queue_depth() for name in stale}).items():
+        if isinstance(depth, Exception):
+          print(f"[Warning] queue depth of backend {name} is not available: {depth}", file=sys.stderr)
+          depths.pop(name, None)
+        else:
+          depths[name] = (depth, now)
+      if not depths:
+        raise Exception("no backend is available. Set the 'backend' parameter to choose one.")
+      name = min((n for n in _BACKENDS if n in depths), key=lambda n: depths[n][0] / _BACKENDS[n]["weight"])
+      # the job is counted at once, so the jobs of a batch are spread over the backends
+      depths[name] = (depths[name][0] + 1, depths[name][1])
+      return name
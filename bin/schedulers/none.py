@@ -1,5 +1,6 @@
-import pathlib,io,os,subprocess
-from typing import List,Tuple,Dict
+import pathlib,os,sys,json,time,fcntl,subprocess,signal,contextlib
+from typing import List,Tuple,Dict,Optional
+from . import runner,eventlog,context
 
 class NoneScheduler:
 
@@ -19,43 +20,346 @@ class NoneScheduler:
     return f". {job_file}\n"
 
   @staticmethod
-  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: io.TextIOBase, parameters: dict) -> Tuple[str,str]:
-    cmd = f"nohup bash {script_path.absolute()} > /dev/null 2>&1 < /dev/null & echo $!"
-    log.write(f"{cmd} is invoked\n")
-    output = ""
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[str,str]:
+    # the job is appended to the local queue, and is started by the runner process when enough cores are free
     os.makedirs(work_dir, exist_ok=True)
-    result = subprocess.run(cmd, shell=True, cwd=work_dir, check=True, stdout=subprocess.PIPE)
-    psid = str(int(result.stdout.splitlines()[-1]))
-    log.write(f"process id: {psid}\n")
-    return (psid, result.stdout.decode())
+    cores = int(parameters.get("mpi_procs", 1)) * int(parameters.get("omp_threads", 1))
+    with NoneScheduler._locked_queue() as queue:
+      queue["next_id"] += 1
+      job_id = f"{NoneScheduler.PREFIX}{queue['next_id']}"
+      # the job runs in the environment of the submitter, not in that of the runner process.
+      # it may hold secrets, so it is kept in a file readable only by the user until the job is started.
+      NoneScheduler._store_env(job_id, context.environ() or dict(os.environ))
+      queue["jobs"][job_id] = {"script": str(script_path.absolute()), "work_dir": str(work_dir.absolute()), "cores": cores, "state": "queued", "submitted_at": time.time()}
+      NoneScheduler._ensure_runner()
+    log.event("queued", job_id=job_id, script=str(script_path.absolute()), cores=cores)
+    return (job_id, f"{job_id}\n")
 
   @staticmethod
   def all_status() -> str:
-    cmd = "ps uxr | head -n 10"
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
-    return result.stdout.decode()
+    result = runner.run(["ps", "uxr"])
+    queue = NoneScheduler._load_queue()
+    counts = {state: sum(1 for j in queue["jobs"].values() if j["state"] == state) for state in ("queued", "running")}
+    used = sum(j["cores"] for j in queue["jobs"].values() if j["state"] == "running")
+    summary = f"local queue: {counts['queued']} queued, {counts['running']} running, {used}/{NoneScheduler.cores()} cores used\n"
+    return summary + "".join(result.stdout.decode().splitlines(keepends=True)[:10])
 
   @staticmethod
   def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    queue = NoneScheduler._load_queue()
+    procs = NoneScheduler._processes([j for j in job_ids if j not in queue["jobs"]] + [str(j["pid"]) for j in queue["jobs"].values() if j["state"] == "running"])
     results = {}
     for job_id in job_ids:
-      results[job_id] = NoneScheduler._status(job_id)
+      job = queue["jobs"].get(job_id)
+      pid = str(job["pid"]) if job and job["state"] == "running" else (None if job else job_id)
+      if job and job["state"] == "queued":
+        results[job_id] = ("queued", f"{job_id} is waiting for {job['cores']} cores")
+      elif job and job["state"] in ("finished", "cancelled"):
+        rc = f" (exit code: {job['returncode']})" if "returncode" in job else ""
+        results[job_id] = ("finished", f"{job_id} is {job['state']}{rc}")
+      elif pid not in procs:
+        results[job_id] = ("finished", "process is not found")
+      else:
+        state, pgid, _ = procs[pid]
+        results[job_id] = ("running", f"  PID STAT  PGID\n{pid} {state} {pgid}\n")
     return results
 
   @staticmethod
-  def _status(job_id: str) -> Tuple[str,str]:
-    cmd = f"ps -p {job_id}"
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
-    status = "running" if result.returncode == 0 else "finished"
-    return (status, result.stdout.decode())
+  def queue_depth() -> int:
+    queue = NoneScheduler._load_queue()
+    return sum(1 for j in queue["jobs"].values() if j["state"] in ("queued", "running"))
 
   @staticmethod
   def delete(job_id: str) -> str:
-    cmd = f"ps -p {job_id} -o 'pgid'"   # get process group id of {job_id}
-    result = subprocess.run(cmd, check=False, shell=True, stdout=subprocess.PIPE)
-    if result.returncode != 0:
-      return f"process for {job_id} is not found"
-    pgid = int(result.stdout.decode().splitlines()[-1])  # process group id
-    cmd = f"kill -TERM -{pgid}"
-    subprocess.run(cmd, shell=True, check=True)
-    return f"process group {pgid} is successfully terminated"
\ No newline at end of file
+    result, raw_output = NoneScheduler.delete_multiple([job_id])[job_id]
+    return raw_output
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    results = {}
+    with NoneScheduler._locked_queue() as queue:
+      pids = {}
+      for job_id in job_ids:
+        job = queue["jobs"].get(job_id)
+        if job is None:
+          pids[job_id] = job_id   # a process started before the local queue was introduced
+        elif job["state"] == "queued":
+          job["state"] = "cancelled"
+          NoneScheduler._take_env(job_id)
+          results[job_id] = ("deleted", f"{job_id} is removed from the local queue")
+        elif job["state"] == "running":
+          job["state"] = "cancelled"
+          pids[job_id] = str(job["pid"])
+        else:
+          results[job_id] = ("error", f"{job_id} is already {job['state']}")
+      procs = NoneScheduler._processes(list(pids.values()))
+      for (job_id,pid) in pids.items():
+        if pid not in procs:
+          results[job_id] = ("error", f"process for {job_id} is not found")
+          continue
+        pgid = procs[pid][1]
+        try:
+          os.killpg(pgid, signal.SIGTERM)
+          results[job_id] = ("deleted", f"process group {pgid} is successfully terminated")
+        except OSError as e:
+          results[job_id] = ("error", str(e))
+    return {job_id: results[job_id] for job_id in job_ids}
+
+  # The local queue is a JSON file in the state directory guarded by a lock file. A detached runner process
+  # (`python3 -m schedulers.none`) starts the queued jobs as long as the sum of `mpi_procs * omp_threads` of the
+  # running jobs fits in XSUB_NONE_CORES (the number of CPUs by default). It exits when no job is left,
+  # and is started again by the next submission.
+  # XSUB_NONE_ORDER selects the job started next: "fifo" (default) waits until the oldest job fits,
+  # and "smallest" starts the job requiring the fewest cores first.
+
+  PREFIX = "local-"
+  POLL_INTERVAL = 0.5
+  # finished jobs kept in the queue file. Older ones are still reported finished, as "process is not found".
+  MAX_FINISHED = 1000
+  FINISHED_TTL = 3600.0
+
+  @staticmethod
+  def cores() -> int:
+    return int(os.environ.get('XSUB_NONE_CORES') or os.cpu_count() or 1)
+
+  @staticmethod
+  def _queue_path() -> pathlib.Path:
+    return NoneScheduler._state_dir().joinpath("queue.json")
+
+  @staticmethod
+  def _load_queue() -> dict:
+    try:
+      with open(NoneScheduler._queue_path()) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {"next_id": 0, "jobs": {}}
+
+  @staticmethod
+  @contextlib.contextmanager
+  def _locked_queue():
+    # yields the queue, which is stored when the block exits without an exception and has changed it
+    path = NoneScheduler._queue_path()
+    NoneScheduler._make_state_dir()
+    with open(path.with_suffix('.lock'), mode='a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        queue = NoneScheduler._load_queue()
+        loaded = json.dumps(queue)
+        yield queue
+        stored = json.dumps(queue)
+        if stored == loaded:
+          return
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, mode='w') as f:
+          f.write(stored)
+        os.replace(tmp, path)
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  _runner_lock = None   # held by the runner process during its lifetime
+
+  @staticmethod
+  def _runner_alive() -> bool:
+    with open(NoneScheduler._state_dir().joinpath("runner.lock"), mode='a') as f:
+      try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        return True
+      fcntl.flock(f, fcntl.LOCK_UN)
+      return False
+
+  @staticmethod
+  def _ensure_runner() -> None:
+    # called with the queue locked. The runner exits only while holding the queue lock with no job left,
+    # so a job added here is always picked up by either the running runner or the new one.
+    if NoneScheduler._runner_alive():
+      return
+    bin_dir = pathlib.Path(__file__).resolve().parent.parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(bin_dir), os.environ.get('PYTHONPATH')])))
+    subprocess.Popen([sys.executable, "-m", "schedulers.none"], cwd=bin_dir, env=env,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+  @staticmethod
+  def _next_jobs(queue: dict, free: int) -> List[str]:
+    queued = [(job_id,job) for (job_id,job) in queue["jobs"].items() if job["state"] == "queued"]
+    queued.sort(key=lambda x: int(x[0][len(NoneScheduler.PREFIX):]))
+    if os.environ.get('XSUB_NONE_ORDER', 'fifo') == 'smallest':
+      queued.sort(key=lambda x: x[1]["cores"])
+    running = any(job["state"] == "running" for job in queue["jobs"].values())
+    started = []
+    for (job_id,job) in queued:
+      # a job larger than the whole budget is started alone
+      cores = min(job["cores"], NoneScheduler.cores())
+      if cores > free:
+        break
+      free -= cores
+      started.append(job_id)
+    if not started and queued and not running:
+      started.append(queued[0][0])
+    return started
+
+  @staticmethod
+  def _run_queue() -> None:
+    lock = open(NoneScheduler._state_dir().joinpath("runner.lock"), mode='a')
+    try:
+      fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      return   # another runner is working
+    children = {}
+    with NoneScheduler._locked_queue() as queue:
+      NoneScheduler._clean_start_times(queue)
+    while True:
+      with NoneScheduler._locked_queue() as queue:
+        for (job_id,job) in queue["jobs"].items():
+          if job["state"] not in ("running", "cancelled") or "pid" not in job or "returncode" in job:
+            continue
+          proc = children.get(job_id)
+          rc = proc.poll() if proc else (None if NoneScheduler._processes([str(job["pid"])]) else -1)
+          if rc is not None:
+            job["returncode"] = rc
+            if job["state"] == "running":
+              job["state"] = "finished"
+            job["finished_at"] = time.time()
+            children.pop(job_id, None)
+            NoneScheduler._forget_start_time(str(job["pid"]))   # the job is reported from the queue from now on
+        used = sum(min(job["cores"], NoneScheduler.cores()) for job in queue["jobs"].values() if job["state"] == "running")
+        for job_id in NoneScheduler._next_jobs(queue, NoneScheduler.cores() - used):
+          job = queue["jobs"][job_id]
+          # a new session detaches the job like nohup, and makes its process group id equal to its pid
+          proc = subprocess.Popen(["bash", job["script"]], cwd=job["work_dir"], env=NoneScheduler._take_env(job_id), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+          NoneScheduler._record_start_time(str(proc.pid))
+          job.update({"state": "running", "pid": proc.pid, "started_at": time.time()})
+          children[job_id] = proc
+        finished = [job_id for (job_id,job) in queue["jobs"].items() if job["state"] in ("finished", "cancelled") and ("returncode" in job or "pid" not in job)]
+        expired = time.time() - NoneScheduler.FINISHED_TTL
+        for (i,job_id) in enumerate(finished):
+          job = queue["jobs"][job_id]
+          if i < len(finished) - NoneScheduler.MAX_FINISHED or job.get("finished_at", job["submitted_at"]) < expired:
+            del queue["jobs"][job_id]
+        if not any(job["state"] == "queued" or (job["state"] in ("running", "cancelled") and "pid" in job and "returncode" not in job) for job in queue["jobs"].values()):
+          fcntl.flock(lock, fcntl.LOCK_UN)   # released with the queue locked. See _ensure_runner.
+          return
+      time.sleep(NoneScheduler.POLL_INTERVAL)
+
+  # process information is read from /proc in a single pass without spawning any process.
+  # on systems without /proc (e.g. macOS), a single `ps` command is run for all the ids instead.
+  # A process is regarded as alive unless it is a zombie, or its start time differs from the one recorded
+  # at submission, which means that the pid has been reused by another process.
+
+  @staticmethod
+  def _processes(job_ids: List[str]) -> Dict[str,Tuple[str,int,str]]:
+    pids = [j for j in dict.fromkeys(job_ids) if j.isdigit()]
+    if not pids:
+      return {}
+    if os.path.isdir("/proc/self"):
+      found = {}
+      for pid in pids:
+        p = NoneScheduler._proc_stat(pid)
+        if p:
+          found[pid] = p
+    else:
+      found = NoneScheduler._ps(pids)
+    return {pid: p for (pid,p) in found.items() if p[0][0] not in "ZX" and NoneScheduler._same_process(pid, p[2])}
+
+  @staticmethod
+  def _proc_stat(pid: str) -> Optional[Tuple[str,int,str]]:
+    try:
+      with open(f"/proc/{pid}/stat") as f:
+        stat = f.read()
+    except OSError:
+      return None
+    # the command name in parentheses may contain spaces, so split the fields after the last ')'
+    fields = stat[stat.rindex(')')+2:].split()
+    return (fields[0], int(fields[2]), fields[19])   # (state, pgrp, starttime)
+
+  @staticmethod
+  def _ps(pids: List[str]) -> Dict[str,Tuple[str,int,str]]:
+    cmd = ["ps", "-o", "pid=,stat=,pgid=,lstart=", "-p", ",".join(pids)]
+    result = runner.run(cmd)
+    found = {}
+    for line in result.stdout.decode().splitlines():
+      cols = line.split(None, 3)
+      if len(cols) == 4:
+        found[cols[0]] = (cols[1], int(cols[2]), cols[3].strip())
+    return found
+
+  @staticmethod
+  def _start_time(pid: str) -> Optional[str]:
+    if os.path.isdir("/proc/self"):
+      p = NoneScheduler._proc_stat(pid)
+    else:
+      p = NoneScheduler._ps([pid]).get(pid)
+    return p[2] if p else None
+
+  @staticmethod
+  def _state_dir() -> pathlib.Path:
+    d = os.environ.get('XSUB_NONE_DIR') or os.path.join(os.path.expanduser('~'), '.xsub', 'none')
+    return pathlib.Path(d)
+
+  @staticmethod
+  def _make_state_dir() -> pathlib.Path:
+    # only the user may read the state, which includes the environments of the queued jobs
+    d = NoneScheduler._state_dir()
+    os.makedirs(d, mode=0o700, exist_ok=True)
+    if d.stat().st_mode & 0o077:
+      os.chmod(d, 0o700)   # created by an older version
+    return d
+
+  @staticmethod
+  def _store_env(job_id: str, env: dict) -> None:
+    fd = os.open(NoneScheduler._make_state_dir().joinpath(f"{job_id}.env"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, mode='w') as f:
+      json.dump(env, f)
+
+  @staticmethod
+  def _take_env(job_id: str) -> Optional[dict]:
+    # the environment of a job, which is removed. None if it is not found, to inherit that of the runner.
+    path = NoneScheduler._state_dir().joinpath(f"{job_id}.env")
+    try:
+      with open(path) as f:
+        env = json.load(f)
+    except (OSError, ValueError):
+      return None
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(path)
+    return env
+
+  @staticmethod
+  def _record_start_time(pid: str) -> None:
+    start = NoneScheduler._start_time(pid)
+    if start is None:
+      return
+    d = NoneScheduler._make_state_dir()
+    with open(d.joinpath(pid), mode='w') as f:
+      f.write(start)
+
+  @staticmethod
+  def _forget_start_time(pid: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(NoneScheduler._state_dir().joinpath(pid))
+
+  @staticmethod
+  def _clean_start_times(queue: dict) -> None:
+    # removes the start times left by processes that are gone, e.g. those started before the local queue was
+    # introduced, or by a runner that was killed. The start times of the jobs running in the queue are kept,
+    # and the others only after FINISHED_TTL, while their ids may still be queried.
+    d = NoneScheduler._state_dir()
+    live = {str(job["pid"]) for job in queue["jobs"].values() if "pid" in job and "returncode" not in job}
+    expired = time.time() - NoneScheduler.FINISHED_TTL
+    pids = [p.name for p in d.iterdir() if p.name.isdigit() and p.name not in live and p.stat().st_mtime < expired]
+    alive = NoneScheduler._processes(pids)
+    for pid in pids:
+      if pid not in alive:
+        NoneScheduler._forget_start_time(pid)
+
+  @staticmethod
+  def _same_process(pid: str, start: str) -> bool:
+    try:
+      with open(NoneScheduler._state_dir().joinpath(pid)) as f:
+        return f.read() == start
+    except OSError:
+      return True   # submitted before the start time was recorded
+
+
+if __name__ == "__main__":
+  NoneScheduler._run_queue()
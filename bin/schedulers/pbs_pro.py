@@ -1,5 +1,6 @@
-import pathlib,io,subprocess,datetime,re
-from typing import List,Tuple,Dict
+import pathlib,time,re,json,getpass
+from typing import List,Tuple,Dict,Optional
+from . import status,cache,array,runner,eventlog
 
 class PBSProScheduler:
 
@@ -51,54 +52,94 @@ cd {work_dir}
     return template.format(account_name=account_name, nodes=nodes, ppn=ppn, walltime=walltime, job_file=job_file, partition_setting=partition, exclusive_setting=exclusive, work_dir=work_dir)
 
   @staticmethod
-  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: io.TextIOBase, parameters: dict) -> Tuple[str,str]:
-    cmd = f"qsub -o {log_dir.absolute()}/xsub.log -e {log_dir.absolute()}/xsub.log {script_path.absolute()}"
-    log.write(f"cmd: {cmd}\ntime: {datetime.datetime.now()}")
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[str,str]:
+    cmd = ["qsub", "-o", f"{log_dir.absolute()}/", "-e", f"{log_dir.absolute()}/", str(script_path.absolute())]
+    started = time.time()
+    result = runner.run(cmd, retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
     output = result.stdout.decode()
+    log.command(cmd, result.returncode, time.time() - started)
     if result.returncode != 0:
-      log.write(f"rc is not zero: {result.returncode} {output}")
-      raise Exception(f"rc is not zero: {output}")
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero: {output}{result.stderr.decode()}")
     job_id = output.splitlines()[-1].split(" ")[-1]
-    log.write(f"job_id: {job_id}")
+    cache.invalidate("pbs_pro")
     return (job_id, output)
 
+  @staticmethod
+  def submit_array(scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[List[str],str]:
+    script_path = array.prepare_array_script(PBSProScheduler, scripts, log_dir, parameters, "PBS_ARRAY_INDEX")
+    cmd = ["qsub", "-J", f"0-{len(scripts)-1}", "-o", f"{log_dir.absolute()}/", "-e", f"{log_dir.absolute()}/", str(script_path.absolute())]
+    started = time.time()
+    result = runner.run(cmd, retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
+    output = result.stdout.decode()
+    log.command(cmd, result.returncode, time.time() - started)
+    if result.returncode != 0:
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero: {output}{result.stderr.decode()}")
+    array_id = output.splitlines()[-1].split(" ")[-1]   # e.g. "1234[].server"
+    cache.invalidate("pbs_pro")
+    return ([array_id.replace("[]", f"[{i}]") for i in range(len(scripts))], output)
+
   @staticmethod
   def all_status() -> str:
-    cmd = "qstat"
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
+    result = runner.run(["qstat"])
     return result.stdout.decode()
 
   @staticmethod
   def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
-    cmd = "qstat"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
-    output_list = result.stdout.decode().splitlines()
-
-    results = {}
-    for job_id in job_ids:
-      pattern = re.compile(f"^\\s*{job_id}")
-      matched = [line for line in output_list if pattern.match(line)]
-      if matched:
-        results[job_id] = PBSProScheduler._parse_status(matched[-1])
-      else:
-        results[job_id] = ("finished", "not found in squeue")
-    return results
+    index = status.query_index("pbs_pro", PBSProScheduler._queue_index, job_ids)
+    return status.lookup(job_ids, index, PBSProScheduler._parse_status, "not found in qstat")
+
+  @staticmethod
+  def queue_depth() -> int:
+    return status.queue_depth("pbs_pro", PBSProScheduler._queue_index, PBSProScheduler._parse_status)
+
+  # error messages printed for ids that are no longer in the queue
+  _UNKNOWN_JOB = re.compile(r'Unknown Job Id|Job has finished')
+
+  @staticmethod
+  def _queue_index(job_ids: Optional[List[str]] = None) -> Dict[str,str]:
+    # -t prints the subjobs of array jobs. -x also prints finished jobs, which are kept in the history.
+    if job_ids is None:
+      # the jobs of the user are selected by the server, so the full attributes of the other users' jobs are
+      # not transferred. A job finishing between the two commands is reported "F" or "not found", both finished.
+      result = runner.run(["qselect", "-u", getpass.getuser()], check=True)
+      job_ids = result.stdout.decode().split()
+    index = {}
+    for chunk in status.chunks(job_ids):
+      cmd = ["qstat", "-f", "-F", "json", "-x", "-t"] + chunk
+      output = status.run_query(cmd, PBSProScheduler._UNKNOWN_JOB)
+      index.update(PBSProScheduler._index_json(output))
+    return index
+
+  @staticmethod
+  def _index_json(output: str) -> Dict[str,str]:
+    # only the id and the state of each job are kept, as a line like "1234.server R"
+    if not output.strip():
+      return {}
+    jobs = json.loads(output).get("Jobs", {})
+    return {status.job_id_key(job_id): f"{job_id} {job['job_state']}" for (job_id,job) in jobs.items()}
+
+  # values of "job_state". A job in the queue with an unknown state is regarded as running.
+  _STATES = {
+    "Q": "queued", "H": "queued", "W": "queued", "T": "queued", "M": "queued",
+    "R": "running", "E": "running", "S": "running", "U": "running", "B": "running",
+    "F": "finished", "X": "finished"
+  }
 
   @staticmethod
   def _parse_status(line: str) -> Tuple[str,str]:
-    c = line.split()[4]
-    if c == 'PD':
-      return ("queued", line)
-    elif c == 'R' or c == 'T' or c == 'E':
-      return ("running", line)
-    elif c == 'C':
-      return ("finished", line)
-    else:
-      raise Exception(f"unknown format {str}")
+    c = line.split()[1]
+    return (PBSProScheduler._STATES.get(c, "running"), line)
 
   @staticmethod
   def delete(job_id: str) -> str:
-    cmd = f"qdel {job_id}"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+    result = runner.run(["qdel", job_id], check=True)
+    cache.invalidate("pbs_pro")
     return result.stdout.decode()
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    results = status.run_cancel("qdel", job_ids, PBSProScheduler._UNKNOWN_JOB)
+    cache.invalidate("pbs_pro")
+    return results
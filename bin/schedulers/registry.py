@@ -0,0 +1,114 @@
+import os,sys,json,time,sqlite3,pathlib,contextlib
+from typing import List,Tuple,Dict
+
+# Opt-in local registry of the submitted jobs, stored in SQLite. It is enabled by setting XSUB_REGISTRY
+# to "on" (~/.xsub/registry.sqlite) or to the path of the database.
+# Once a registered job is confirmed finished, later status requests for it are answered from the registry,
+# so only the ids of live jobs are sent to the scheduler.
+
+# upper bound of the number of ids in a single SQL statement
+MAX_SQL_VARIABLES = 500
+
+# number of consecutive "finished" answers of the scheduler after which a job is regarded as finished for good
+CONFIRMATIONS = 2
+
+def path():
+  p = os.environ.get('XSUB_REGISTRY') or 'off'
+  if p == 'off':
+    return None
+  if p == 'on':
+    return pathlib.Path(os.path.join(os.path.expanduser('~'), '.xsub', 'registry.sqlite'))
+  return pathlib.Path(p)
+
+def _xsub_type() -> str:
+  return os.environ.get('XSUB_TYPE', '').lower()
+
+@contextlib.contextmanager
+def _connect():
+  p = path()
+  os.makedirs(p.parent, exist_ok=True)
+  conn = sqlite3.connect(str(p), timeout=30)
+  try:
+    with conn:
+      conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        xsub_type TEXT NOT NULL, job_id TEXT NOT NULL,
+        parent_script TEXT, work_dir TEXT, log_dir TEXT, parameters TEXT, submitted_at REAL,
+        status TEXT, raw_output TEXT, finished_at REAL, misses INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (xsub_type, job_id))''')
+      if "misses" not in [c[1] for c in conn.execute("PRAGMA table_info(jobs)")]:
+        conn.execute("ALTER TABLE jobs ADD COLUMN misses INTEGER NOT NULL DEFAULT 0")   # created by an older version
+      yield conn
+  finally:
+    conn.close()
+
+def _warn(e: Exception) -> None:
+  # the registry is an optimization. The commands keep working without it.
+  print(f"[Warning] job registry is not available: {e}", file=sys.stderr)
+
+def record(submissions: List[dict]) -> None:
+  # each submission is a dict having "job_id", "parent_script", "work_dir", "log_dir", and "parameters"
+  if path() is None or not submissions:
+    return
+  now = time.time()
+  rows = [(_xsub_type(), s["job_id"], str(s["parent_script"]), str(s["work_dir"]), str(s["log_dir"]), json.dumps(s["parameters"]), now) for s in submissions]
+  try:
+    with _connect() as conn:
+      # a job id may be reused, e.g. a process id of the "none" scheduler, so the old record is replaced
+      conn.executemany('''INSERT OR REPLACE INTO jobs (xsub_type, job_id, parent_script, work_dir, log_dir, parameters, submitted_at, status, misses)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'submitted', 0)''', rows)
+  except (sqlite3.Error, OSError) as e:
+    _warn(e)
+
+def _registered(conn, job_ids: List[str]) -> Dict[str,tuple]:
+  # {job_id: (status, raw_output, misses)} of the registered jobs among `job_ids`
+  found = {}
+  for i in range(0, len(job_ids), MAX_SQL_VARIABLES):
+    chunk = job_ids[i:i+MAX_SQL_VARIABLES]
+    marks = ",".join("?" * len(chunk))
+    cur = conn.execute(f"SELECT job_id, status, raw_output, misses FROM jobs WHERE xsub_type = ? AND job_id IN ({marks})", [_xsub_type()] + chunk)
+    found.update((r[0], r[1:]) for r in cur.fetchall())
+  return found
+
+def multiple_status(scheduler, job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+  # same as `scheduler.multiple_status`, but the jobs known to be finished are not queried
+  job_ids = list(dict.fromkeys(job_ids))
+  if path() is None:
+    return scheduler.multiple_status(job_ids)
+  registered = None
+  try:
+    with _connect() as conn:
+      registered = _registered(conn, job_ids)
+  except (sqlite3.Error, OSError) as e:
+    _warn(e)
+  if registered is None:
+    return scheduler.multiple_status(job_ids)
+  finished = {job_id: r[1] for (job_id,r) in registered.items() if r[0] == "finished"}
+  live = [job_id for job_id in job_ids if job_id not in finished]
+  results = scheduler.multiple_status(live) if live else {}
+
+  # a single "finished" answer may be wrong (e.g. the controller dropped the job from its listing for a moment),
+  # so a job is stored as finished only after CONFIRMATIONS answers in a row
+  confirmed, misses = [], []
+  now = time.time()
+  for (job_id,(stat,raw_output)) in results.items():
+    if job_id not in registered:
+      if stat == "finished":
+        results[job_id] = (stat, f"{raw_output} (not in the job registry)")
+    elif stat != "finished":
+      if registered[job_id][2]:
+        misses.append((0, _xsub_type(), job_id))
+    elif registered[job_id][2] + 1 >= CONFIRMATIONS:
+      confirmed.append((raw_output, now, registered[job_id][2] + 1, _xsub_type(), job_id))
+    else:
+      misses.append((registered[job_id][2] + 1, _xsub_type(), job_id))
+  if confirmed or misses:
+    try:
+      with _connect() as conn:
+        conn.executemany("UPDATE jobs SET status = 'finished', raw_output = ?, finished_at = ?, misses = ? WHERE xsub_type = ? AND job_id = ? AND status != 'finished'", confirmed)
+        conn.executemany("UPDATE jobs SET misses = ? WHERE xsub_type = ? AND job_id = ? AND status != 'finished'", misses)
+    except (sqlite3.Error, OSError) as e:
+      _warn(e)
+
+  for (job_id,raw_output) in finished.items():
+    results[job_id] = ("finished", raw_output)
+  return {job_id: results[job_id] for job_id in job_ids}
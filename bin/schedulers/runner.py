@@ -0,0 +1,94 @@
+import os,re,time,random,fcntl,getpass,shlex,subprocess,contextlib
+from typing import List,Optional
+from . import trace,cache,context
+
+# Every external command of the schedulers (sbatch, squeue, qstat, ps, ...) is run through here.
+# - argv lists are executed directly without a shell, so paths need no quoting.
+# - each call has a timeout (XSUB_COMMAND_TIMEOUT seconds, 120 by default).
+# - transient failures of the scheduler, like "Socket timed out", are retried up to XSUB_COMMAND_RETRIES times
+#   with a jittered exponential backoff starting from XSUB_COMMAND_BACKOFF seconds.
+# - at most XSUB_MAX_CONCURRENT_COMMANDS commands (8 by default, 0 for no limit) run at the same time for each user.
+#   The slots are lock files, which are released by the OS even when a process is killed.
+# - each call is traced with its argv, return code, output size, and duration.
+# - in a backend of the multi scheduler or for a client of xsubd, the commands get its environment (see context.py).
+
+# messages of the schedulers when the server is overloaded or unreachable
+TRANSIENT_ERRORS = re.compile(r'Socket timed out|Connection timed out|Connection refused|Unable to contact|temporarily unavailable|try again|cannot connect to server|Communication failure|Transport endpoint|pbs_iff', re.IGNORECASE)
+# the subset meaning that the request did not reach the server. Submissions are retried only on these
+# (and not on timeouts), so that a job is never submitted twice.
+CONNECT_ERRORS = re.compile(r'Connection refused|Unable to contact|cannot connect to server|pbs_iff', re.IGNORECASE)
+
+MAX_BACKOFF = 30.0
+
+def timeout() -> Optional[float]:
+  t = float(os.environ.get('XSUB_COMMAND_TIMEOUT') or 120)
+  return t if t > 0 else None
+
+def retries() -> int:
+  return int(os.environ.get('XSUB_COMMAND_RETRIES') or 3)
+
+def backoff(attempt: int) -> float:
+  # "full jitter": concurrent clients failing together do not retry together
+  base = float(os.environ.get('XSUB_COMMAND_BACKOFF') or 1.0)
+  return random.uniform(0, min(MAX_BACKOFF, base * 2**attempt))
+
+def max_concurrent() -> int:
+  return int(os.environ.get('XSUB_MAX_CONCURRENT_COMMANDS') or 8)
+
+@contextlib.contextmanager
+def _slot():
+  n = max_concurrent()
+  if n <= 0:
+    yield
+    return
+  d = cache.cache_dir()
+  os.makedirs(d, exist_ok=True)
+  user = getpass.getuser()
+  files = [open(d.joinpath(f"slot_{user}_{i}.lock"), mode='a') for i in range(n)]
+  try:
+    delay = 0.01
+    while True:
+      # the slots are tried in a random order so that waiting processes spread over them
+      for f in random.sample(files, n):
+        try:
+          fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+          continue
+        try:
+          yield
+        finally:
+          fcntl.flock(f, fcntl.LOCK_UN)
+        return
+      time.sleep(random.uniform(0, delay))
+      delay = min(delay * 2, 1.0)
+  finally:
+    for f in files:
+      f.close()
+
+def run(argv: List[str], check: bool = False, cwd=None, retry_on: Optional[re.Pattern] = TRANSIENT_ERRORS, retry_on_timeout: bool = True) -> subprocess.CompletedProcess:
+  # returns the CompletedProcess with stdout and stderr captured as bytes.
+  # an Exception is raised when the command times out for the last time, or when check=True and rc is not zero.
+  argv = [str(a) for a in argv]
+  t = timeout()
+  n = retries()
+  for attempt in range(n + 1):
+    last = (attempt == n)
+    with _slot():
+      start = time.perf_counter()
+      try:
+        result = subprocess.run(argv, cwd=cwd or context.cwd(), env=context.environ(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=t)
+      except subprocess.TimeoutExpired as e:
+        trace.command(argv, None, len(e.stdout or b"") + len(e.stderr or b""), time.perf_counter() - start)
+        if last or not retry_on_timeout:
+          raise Exception(f"{shlex.join(argv)} timed out after {t} seconds")
+        result = None
+      else:
+        trace.command(argv, result.returncode, len(result.stdout) + len(result.stderr), time.perf_counter() - start)
+    if result is not None:
+      transient = result.returncode != 0 and retry_on is not None and retry_on.search(result.stderr.decode(errors='replace'))
+      if last or not transient:
+        break
+    time.sleep(backoff(attempt))
+  if check and result.returncode != 0:
+    raise Exception(f"rc is not zero for {shlex.join(argv)}: {result.returncode} {result.stderr.decode(errors='replace')}")
+  return result
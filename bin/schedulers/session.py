@@ -0,0 +1,66 @@
+from typing import List,Tuple,Dict,Optional
+from . import core,cache,create
+
+# In-process interface of xsub for Python drivers. The methods return the same objects as the commands print as JSON.
+#
+#   import sys; sys.path.insert(0, "/path/to/xsub_py/bin")
+#   import schedulers
+#   session = schedulers.Session()     # the scheduler is selected by XSUB_TYPE as for the commands
+#   job = session.submit("run.sh", work_dir="work", log_dir="log", parameters={"mpi_procs": 4})
+#   session.multiple_status([job["job_id"]])
+#
+# Status queries of a session fetch the whole queue of the user once, and answer the following queries from it
+# for `snapshot_ttl` seconds. Submissions and cancellations through the session discard the snapshot.
+
+class Session:
+
+  def __init__(self, scheduler=None, snapshot_ttl: float = 5.0):
+    self.scheduler = scheduler or create()
+    self.snapshot_ttl = snapshot_ttl
+    self._snapshots = {}
+    core.compiled_formats(self.scheduler)
+
+  def _scope(self):
+    return cache.in_memory(self._snapshots, self.snapshot_ttl)
+
+  def template(self) -> dict:
+    return core.template(self.scheduler)
+
+  def verify_parameters(self, parameters: dict) -> dict:
+    # the parameters with the defaults filled in. An Exception is raised if they are invalid.
+    with self._scope():
+      return core.verify_parameters(parameters, self.scheduler)
+
+  def submit(self, job_script: str, work_dir: str = ".", log_dir: str = ".", parameters: Optional[dict] = None) -> dict:
+    with self._scope():
+      return core.submit(self.scheduler, job_script, work_dir, log_dir, parameters or {})
+
+  def submit_batch(self, entries: List[dict]) -> List[dict]:
+    # each entry is a dict like {"job_script": "run.sh", "dir": "work", "log": "log", "parameters": {...}}.
+    # one result per entry, which has "error" instead of "job_id" if the submission failed.
+    with self._scope():
+      return core.submit_batch(self.scheduler, [core.resolve_entry(e) for e in entries])
+
+  def status(self, job_id: str) -> dict:
+    with self._scope():
+      return core.status(self.scheduler, job_id)
+
+  def multiple_status(self, job_ids: List[str]) -> Dict[str,dict]:
+    with self._scope():
+      return core.multiple_status(self.scheduler, job_ids)
+
+  def all_status(self) -> str:
+    return self.scheduler.all_status()
+
+  def delete(self, job_id: str) -> Tuple[str,str]:
+    # (stdout, stderr) of xdel
+    with self._scope():
+      return core.delete(self.scheduler, job_id)
+
+  def delete_multiple(self, job_ids: List[str]) -> Dict[str,dict]:
+    with self._scope():
+      return core.delete_multiple(self.scheduler, job_ids)
+
+  def refresh(self) -> None:
+    # discards the snapshots, so that the next query asks the scheduler
+    self._snapshots.clear()
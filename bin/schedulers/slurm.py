@@ -1,5 +1,6 @@
-import pathlib,io,subprocess,datetime,re
-from typing import List,Tuple,Dict
+import pathlib,time,re,getpass
+from typing import List,Tuple,Dict,Optional
+from . import status,cache,array,runner,eventlog
 
 class SlurmScheduler:
 
@@ -47,54 +48,87 @@ class SlurmScheduler:
     return template.format(nodes=nodes, ppn=ppn, walltime=walltime, job_file=job_file, partition_setting=partition, exclusive_setting=exclusive)
 
   @staticmethod
-  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: io.TextIOBase, parameters: dict) -> Tuple[str,str]:
-    cmd = f"sbatch -D {work_dir.absolute()} -o {log_dir.absolute()}/xsub.log -e {log_dir.absolute()}/xsub.log {script_path.absolute()}"
-    log.write(f"cmd: {cmd}\ntime: {datetime.datetime.now()}")
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[str,str]:
+    cmd = ["sbatch", "-D", str(work_dir.absolute()), "-o", f"{log_dir.absolute()}/slurm-%j.out", str(script_path.absolute())]
+    started = time.time()
+    result = runner.run(cmd, retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
     output = result.stdout.decode()
+    log.command(cmd, result.returncode, time.time() - started)
     if result.returncode != 0:
-      log.write(f"rc is not zero: {result.returncode} {output}")
-      raise Exception(f"rc is not zero: {output}")
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero: {output}{result.stderr.decode()}")
     job_id = output.splitlines()[-1].split(" ")[-1]
-    log.write(f"job_id: {job_id}")
+    cache.invalidate("slurm")
     return (job_id, output)
 
+  @staticmethod
+  def submit_array(scripts: List[Tuple[pathlib.Path,pathlib.Path]], log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[List[str],str]:
+    script_path = array.prepare_array_script(SlurmScheduler, scripts, log_dir, parameters, "SLURM_ARRAY_TASK_ID")
+    cmd = ["sbatch", f"--array=0-{len(scripts)-1}", "-D", str(scripts[0][1].absolute()), "-o", f"{log_dir.absolute()}/slurm-%A_%a.out", str(script_path.absolute())]
+    started = time.time()
+    result = runner.run(cmd, retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
+    output = result.stdout.decode()
+    log.command(cmd, result.returncode, time.time() - started)
+    if result.returncode != 0:
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero: {output}{result.stderr.decode()}")
+    array_id = output.splitlines()[-1].split(" ")[-1]
+    cache.invalidate("slurm")
+    return ([f"{array_id}_{i}" for i in range(len(scripts))], output)
+
   @staticmethod
   def all_status() -> str:
-    cmd = "squeue"
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
+    result = runner.run(["squeue"])
     return result.stdout.decode()
 
   @staticmethod
   def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
-    cmd = "squeue"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
-    output_list = result.stdout.decode().splitlines()
-
-    results = {}
-    for job_id in job_ids:
-      pattern = re.compile(f"^\\s*{job_id}")
-      matched = [line for line in output_list if pattern.match(line)]
-      if matched:
-        results[job_id] = SlurmScheduler._parse_status(matched[-1])
-      else:
-        results[job_id] = ("finished", "not found in squeue")
-    return results
+    index = status.query_index("slurm", SlurmScheduler._queue_index, job_ids)
+    return status.lookup(job_ids, index, SlurmScheduler._parse_status, "not found in squeue")
+
+  @staticmethod
+  def queue_depth() -> int:
+    return status.queue_depth("slurm", SlurmScheduler._queue_index, SlurmScheduler._parse_status)
+
+  # error messages printed for ids that are no longer in the queue
+  _UNKNOWN_JOB = re.compile(r'Invalid job id|already completing or completed')
+
+  # job id, state code, elapsed time, and the reason or the node list. -r prints array elements one per line.
+  _QUEUE_FORMAT = ["-h", "-r", "-o", "%i %t %M %R"]
+
+  @staticmethod
+  def _queue_index(job_ids: Optional[List[str]] = None) -> Dict[str,str]:
+    if job_ids is None:
+      result = runner.run(["squeue"] + SlurmScheduler._QUEUE_FORMAT + ["-u", getpass.getuser()], check=True)
+      return status.index_lines(result.stdout.decode().splitlines())
+    index = {}
+    for chunk in status.chunks(job_ids):
+      cmd = ["squeue"] + SlurmScheduler._QUEUE_FORMAT + ["-j", ",".join(chunk)]
+      output = status.run_query(cmd, SlurmScheduler._UNKNOWN_JOB)
+      index.update(status.index_lines(output.splitlines()))
+    return index
+
+  # compact state codes of squeue. A job in the queue with an unknown state is regarded as running.
+  _STATES = {
+    "PD": "queued", "CF": "queued", "RQ": "queued", "RH": "queued", "RF": "queued",
+    "R": "running", "CG": "running", "RS": "running", "S": "running", "ST": "running", "SI": "running", "SO": "running",
+    "CD": "finished", "CA": "finished", "F": "finished", "TO": "finished", "NF": "finished", "PR": "finished",
+    "OOM": "finished", "BF": "finished", "DL": "finished", "RV": "finished", "SE": "finished"
+  }
 
   @staticmethod
   def _parse_status(line: str) -> Tuple[str,str]:
-    c = line.split()[4]
-    if c == 'PD':
-      return ("queued", line)
-    elif c == 'R' or c == 'T' or c == 'E':
-      return ("running", line)
-    elif c == 'C':
-      return ("finished", line)
-    else:
-      raise Exception(f"unknown format {str}")
+    c = line.split()[1]
+    return (SlurmScheduler._STATES.get(c, "running"), line)
 
   @staticmethod
   def delete(job_id: str) -> str:
-    cmd = f"scancel {job_id}"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+    result = runner.run(["scancel", job_id], check=True)
+    cache.invalidate("slurm")
     return result.stdout.decode()
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    results = status.run_cancel("scancel", job_ids, SlurmScheduler._UNKNOWN_JOB)
+    cache.invalidate("slurm")
+    return results
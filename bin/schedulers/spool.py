@@ -0,0 +1,212 @@
+import os,re,json,time,fcntl,sqlite3,pathlib,contextlib
+from typing import List,Tuple,Dict,Callable
+from . import registry,eventlog
+
+# Optional client-side spool for sites that limit the number of queued jobs per user.
+# It is enabled by XSUB_SPOOL=on, or by XSUB_SPOOL_LIMIT, the maximum number of jobs submitted from the spool
+# that may be in the scheduler queue at the same time.
+# The jobs are first written to a local queue (~/.xsub/spool.sqlite, or XSUB_SPOOL_DB), and are submitted in order
+# until the limit is reached or the scheduler rejects a job because of its own limit. The jobs left in the spool
+# get local ids like "spool-12", which stay valid after they are dispatched. `xspool` or xsubd dispatches them later.
+
+PREFIX = "spool-"
+
+# rejections by the scheduler because of a per-user limit. A scheduler may override it by QUEUE_LIMIT_ERRORS.
+QUEUE_LIMIT_ERRORS = re.compile(r'MaxSubmit|job submit limit|per-user limit|Maximum number of jobs|would exceed|upper limit', re.IGNORECASE)
+
+def enabled() -> bool:
+  return os.environ.get('XSUB_SPOOL', '').lower() in ('1', 'on', 'true') or limit() is not None
+
+def limit():
+  l = os.environ.get('XSUB_SPOOL_LIMIT')
+  return int(l) if l else None
+
+def path() -> pathlib.Path:
+  p = os.environ.get('XSUB_SPOOL_DB')
+  return pathlib.Path(p or os.path.join(os.path.expanduser('~'), '.xsub', 'spool.sqlite'))
+
+def _xsub_type() -> str:
+  return os.environ.get('XSUB_TYPE', '').lower()
+
+@contextlib.contextmanager
+def _locked():
+  # held while jobs are dispatched, so that concurrent dispatchers never submit a job twice
+  p = path()
+  os.makedirs(p.parent, exist_ok=True)
+  with open(p.with_suffix('.lock'), mode='a') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(lock, fcntl.LOCK_UN)
+
+@contextlib.contextmanager
+def _connect():
+  p = path()
+  os.makedirs(p.parent, exist_ok=True)
+  conn = sqlite3.connect(str(p), timeout=30)
+  conn.row_factory = sqlite3.Row
+  try:
+    with conn:
+      # state is one of "spooled", "dispatched", "done" (dispatched and found finished), "cancelled", or "error"
+      conn.execute('''CREATE TABLE IF NOT EXISTS spool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, xsub_type TEXT NOT NULL,
+        parent_script TEXT, work_dir TEXT, log_dir TEXT, parameters TEXT, spooled_at REAL,
+        state TEXT NOT NULL, job_id TEXT, raw_output TEXT, dispatched_at REAL)''')
+      conn.execute("CREATE INDEX IF NOT EXISTS spool_state ON spool (xsub_type, state)")
+      yield conn
+  finally:
+    conn.close()
+
+def spool_id(row_id: int) -> str:
+  return f"{PREFIX}{row_id}"
+
+def _row_id(job_id: str):
+  n = job_id[len(PREFIX):]
+  return int(n) if job_id.startswith(PREFIX) and n.isdigit() else None
+
+def _is_limit_error(scheduler, e: Exception) -> bool:
+  return bool(getattr(scheduler, "QUEUE_LIMIT_ERRORS", QUEUE_LIMIT_ERRORS).search(str(e)))
+
+def _free_slots(scheduler, conn, wanted: int) -> int:
+  l = limit()
+  if l is None:
+    return wanted
+  live = [r["job_id"] for r in conn.execute("SELECT job_id FROM spool WHERE xsub_type = ? AND state = 'dispatched'", (_xsub_type(),))]
+  if live:
+    stats = registry.multiple_status(scheduler, live)
+    done = [job_id for job_id in live if stats[job_id][0] == "finished"]
+    conn.executemany("UPDATE spool SET state = 'done' WHERE xsub_type = ? AND job_id = ? AND state = 'dispatched'", [(_xsub_type(), job_id) for job_id in done])
+    live = [job_id for job_id in live if stats[job_id][0] != "finished"]
+  return max(0, min(wanted, l - len(live)))
+
+def _dispatch(scheduler) -> int:
+  # must be called with the lock held
+  with _connect() as conn:
+    rows = conn.execute("SELECT * FROM spool WHERE xsub_type = ? AND state = 'spooled' ORDER BY id", (_xsub_type(),)).fetchall()
+    if not rows:
+      return 0
+    free = _free_slots(scheduler, conn, len(rows))
+  dispatched = 0
+  for row in rows[:free]:
+    log_dir = pathlib.Path(row["log_dir"])
+    try:
+      with eventlog.open_log(log_dir) as log:
+        started = time.time()
+        try:
+          job_id, raw_output = scheduler.submit_job(pathlib.Path(row["parent_script"]), pathlib.Path(row["work_dir"]), log_dir, log, json.loads(row["parameters"]))
+        except Exception as e:
+          if not _is_limit_error(scheduler, e):
+            log.event("failed", spool_id=spool_id(row["id"]), parent_script=row["parent_script"], error=str(e), duration_s=round(time.time() - started, 3))
+          raise
+        log.event("submitted", job_id=job_id, spool_id=spool_id(row["id"]), parent_script=row["parent_script"], duration_s=round(time.time() - started, 3))
+    except Exception as e:
+      if _is_limit_error(scheduler, e):
+        break   # the scheduler is full. The job stays in the spool.
+      with _connect() as conn:
+        conn.execute("UPDATE spool SET state = 'error', raw_output = ? WHERE id = ?", (str(e), row["id"]))
+      continue
+    with _connect() as conn:
+      conn.execute("UPDATE spool SET state = 'dispatched', job_id = ?, raw_output = ?, dispatched_at = ? WHERE id = ?", (job_id, raw_output, time.time(), row["id"]))
+    registry.record([{"job_id": job_id, "parent_script": row["parent_script"], "work_dir": row["work_dir"], "log_dir": row["log_dir"], "parameters": json.loads(row["parameters"])}])
+    dispatched += 1
+  return dispatched
+
+def dispatch(scheduler) -> int:
+  # submits the spooled jobs in order as far as the limits allow. Returns the number of dispatched jobs.
+  with _locked():
+    return _dispatch(scheduler)
+
+def pending() -> int:
+  with _connect() as conn:
+    return conn.execute("SELECT COUNT(*) FROM spool WHERE xsub_type = ? AND state = 'spooled'", (_xsub_type(),)).fetchone()[0]
+
+def submit(scheduler, jobs: List[dict]) -> List[dict]:
+  # each job is a dict having "parent_script", "work_dir", "log_dir", and "parameters".
+  # jobs are appended to the spool after the ones already waiting, so the order of submission is kept.
+  # returns {"job_id": ..., "raw_output": ...} or {"error": ...} for each job. Spooled jobs get a local id.
+  now = time.time()
+  with _locked():
+    with _connect() as conn:
+      row_ids = []
+      for job in jobs:
+        cur = conn.execute("INSERT INTO spool (xsub_type, parent_script, work_dir, log_dir, parameters, spooled_at, state) VALUES (?, ?, ?, ?, ?, ?, 'spooled')",
+          (_xsub_type(), str(job["parent_script"]), str(job["work_dir"]), str(job["log_dir"]), json.dumps(job["parameters"]), now))
+        row_ids.append(cur.lastrowid)
+    _dispatch(scheduler)
+    with _connect() as conn:
+      rows = {r["id"]: r for r in _select(conn, row_ids)}
+  results = []
+  for row_id in row_ids:
+    row = rows[row_id]
+    if row["state"] == "error":
+      results.append({"error": row["raw_output"]})
+    elif row["state"] == "spooled":
+      results.append({"job_id": spool_id(row_id), "raw_output": f"{spool_id(row_id)} is spooled until the scheduler accepts more jobs\n"})
+    else:
+      results.append({"job_id": row["job_id"], "raw_output": row["raw_output"]})
+  return results
+
+def _select(conn, row_ids: List[int]) -> List[sqlite3.Row]:
+  rows = []
+  for i in range(0, len(row_ids), registry.MAX_SQL_VARIABLES):
+    chunk = row_ids[i:i+registry.MAX_SQL_VARIABLES]
+    rows += conn.execute(f"SELECT * FROM spool WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+  return rows
+
+def resolve(job_ids: List[str]) -> Dict[str,sqlite3.Row]:
+  # rows of the local ids among `job_ids`. The spool is not opened unless a local id is given.
+  row_ids = {_row_id(j): j for j in job_ids if _row_id(j) is not None}
+  if not row_ids:
+    return {}
+  with _connect() as conn:
+    return {row_ids[r["id"]]: r for r in _select(conn, list(row_ids)) if r["xsub_type"] == _xsub_type()}
+
+def multiple_status(scheduler, job_ids: List[str], query: Callable) -> Dict[str,Tuple[str,str]]:
+  # same as `query(scheduler, job_ids)`, but the local ids are answered from the spool, or by the dispatched job
+  rows = resolve(job_ids)
+  mapped = [r["job_id"] for r in rows.values() if r["state"] in ("dispatched", "done")]
+  to_query = [j for j in job_ids if j not in rows] + mapped
+  results = query(scheduler, to_query) if to_query else {}
+  output = {}
+  for job_id in job_ids:
+    row = rows.get(job_id)
+    if row is None:
+      output[job_id] = results[job_id]
+    elif row["state"] == "spooled":
+      output[job_id] = ("queued", f"{job_id} is spooled")
+    elif row["state"] in ("dispatched", "done"):
+      stat, raw_output = results[row["job_id"]]
+      output[job_id] = (stat, f"{job_id} is dispatched as {row['job_id']}\n{raw_output}")
+    elif row["state"] == "cancelled":
+      output[job_id] = ("finished", f"{job_id} was cancelled before it was dispatched")
+    else:
+      output[job_id] = ("finished", f"{job_id} failed to be dispatched: {row['raw_output']}")
+  return output
+
+def delete_multiple(scheduler, job_ids: List[str], delete: Callable) -> Dict[str,dict]:
+  # same as `delete(scheduler, job_ids)`, but spooled jobs are removed from the spool,
+  # and the dispatched ones are cancelled by their scheduler ids
+  if not any(_row_id(j) is not None for j in job_ids):
+    return delete(scheduler, job_ids)
+  output = {}
+  with _locked():
+    rows = resolve(job_ids)
+    spooled = [r["id"] for r in rows.values() if r["state"] == "spooled"]
+    if spooled:
+      with _connect() as conn:
+        conn.executemany("UPDATE spool SET state = 'cancelled' WHERE id = ?", [(i,) for i in spooled])
+  mapped = {r["job_id"]: job_id for (job_id,r) in rows.items() if r["state"] in ("dispatched", "done")}
+  to_delete = [j for j in job_ids if j not in rows] + list(mapped)
+  deleted = delete(scheduler, to_delete) if to_delete else {}
+  for job_id in job_ids:
+    row = rows.get(job_id)
+    if row is None:
+      output[job_id] = deleted[job_id]
+    elif row["state"] == "spooled":
+      output[job_id] = {"result": "deleted", "raw_output": f"{job_id} is removed from the spool"}
+    elif row["state"] in ("dispatched", "done"):
+      output[job_id] = deleted[row["job_id"]]
+    else:
+      output[job_id] = {"result": "finished", "raw_output": f"job is already finished or does not exist: {job_id}"}
+  return output
@@ -0,0 +1,104 @@
+import re,time,shlex
+from typing import List,Tuple,Dict,Callable,Optional,Iterator
+from . import cache,runner
+
+# Helpers shared by the schedulers that parse the output of a queue command (squeue, qstat, pjstat).
+# The output is parsed once into a dict keyed by job id, then each requested id is answered by a lookup.
+
+# upper bound of the length of the job ids given to a single query command, well below the argv limits
+MAX_QUERY_CHARS = 32768
+
+def job_id_key(job_id: str) -> str:
+  # torque and PBS Pro print job ids like "1234.server" (sometimes truncated), so compare the part before the first "."
+  return job_id.strip().split('.')[0]
+
+def index_lines(lines: List[str], key: Callable[[str],str] = job_id_key, column: int = 0) -> Dict[str,str]:
+  index = {}
+  for line in lines:
+    cols = line.split()
+    if len(cols) <= column or not cols[column][:1].isdigit():
+      continue   # headers and separators like "Job ID ..." and "------"
+    index[key(cols[column])] = line   # when an id appears more than once, the last line wins
+  return index
+
+def lookup(job_ids: List[str], index: Dict[str,str], parse: Callable[[str],Tuple[str,str]], not_found: str, key: Callable[[str],str] = job_id_key) -> Dict[str,Tuple[str,str]]:
+  results = {}
+  for job_id in job_ids:
+    line = index.get(key(job_id))
+    if line is None:
+      results[job_id] = ("finished", not_found)
+    else:
+      results[job_id] = parse(line)
+  return results
+
+def chunks(job_ids: List[str], max_chars: int = MAX_QUERY_CHARS) -> Iterator[List[str]]:
+  chunk, size = [], 0
+  for job_id in dict.fromkeys(job_ids):   # drop duplicates keeping the order
+    if chunk and size + len(job_id) + 1 > max_chars:
+      yield chunk
+      chunk, size = [], 0
+    chunk.append(job_id)
+    size += len(job_id) + 1
+  if chunk:
+    yield chunk
+
+def run_query(cmd: List[str], unknown_job: re.Pattern) -> str:
+  # queries for specific ids fail when some of them are not in the queue anymore.
+  # such errors are ignored, but any other error is raised so that jobs are not mistaken for "finished".
+  result = runner.run(cmd)
+  if result.returncode != 0:
+    errors = [l for l in result.stderr.decode().splitlines() if l.strip() and not unknown_job.search(l)]
+    if errors or not result.stderr.strip():
+      raise Exception(f"rc is not zero for {shlex.join(cmd)}: {result.returncode} {result.stderr.decode()}")
+  return result.stdout.decode()
+
+def query_index(scheduler_type: str, fetch: Callable[[Optional[List[str]]],Dict[str,str]], job_ids: List[str]) -> Dict[str,str]:
+  # `fetch(None)` queries every job of the user, `fetch(ids)` only the given ids.
+  # a cached snapshot must cover the ids of every later caller, so it always stores the former.
+  if cache.enabled():
+    started = time.time()
+    index, fetched_at = cache.snapshot(scheduler_type, lambda: fetch(None))
+    missing = [job_id for job_id in job_ids if job_id_key(job_id) not in index]
+    if missing and fetched_at < started:
+      # a reused snapshot lacks the jobs submitted by other processes since it was taken.
+      # they are asked for, rather than reported finished.
+      index = dict(index, **fetch(missing))
+    return index
+  if not job_ids:
+    return {}
+  return fetch(job_ids)
+
+def queue_depth(scheduler_type: str, fetch: Callable[[Optional[List[str]]],Dict[str,str]], parse: Callable[[str],Tuple[str,str]]) -> int:
+  # number of the user's jobs waiting or running in the queue, from the shared snapshot if it is fresh
+  index, _ = cache.snapshot(scheduler_type, lambda: fetch(None))
+  return sum(1 for line in index.values() if parse(line)[0] != "finished")
+
+def run_cancel(command: str, job_ids: List[str], unknown_job: re.Pattern) -> Dict[str,Tuple[str,str]]:
+  # cancels the jobs with as few commands as possible, like "scancel id1 id2 ...".
+  # when the command fails, the jobs named in the error messages are failed, or finished if the messages say they
+  # are not in the queue anymore, and the others are deleted. When no job is named, they are all failed with
+  # the whole messages, since the command may have stopped before reaching them (e.g. the server is unreachable).
+  results = {}
+  for chunk in chunks(job_ids):
+    result = runner.run([command] + chunk)
+    output = result.stdout.decode()
+    if result.returncode == 0:
+      results.update({job_id: ("deleted", output) for job_id in chunk})
+      continue
+    errors = result.stderr.decode().splitlines()
+    named = {}
+    for job_id in chunk:
+      mentioned = re.compile(r'(?<!\w)' + re.escape(job_id) + r'(?!\w)')
+      named[job_id] = [l for l in errors if mentioned.search(l)]
+    if not any(named.values()):
+      results.update({job_id: ("error", "\n".join(errors) or f"{command} failed with rc {result.returncode}") for job_id in chunk})
+      continue
+    for job_id in chunk:
+      failed = named[job_id]
+      if not failed:
+        results[job_id] = ("deleted", output)
+      elif all(unknown_job.search(l) for l in failed):
+        results[job_id] = ("finished", "\n".join(failed))
+      else:
+        results[job_id] = ("error", "\n".join(failed))
+  return results
@@ -1,5 +1,6 @@
-import pathlib,io,subprocess,datetime,re
-from typing import List,Tuple,Dict
+import pathlib,time,re,getpass
+from typing import List,Tuple,Dict,Optional
+from . import status,cache,runner,eventlog
 
 class TorqueScheduler:
 
@@ -34,54 +35,74 @@ class TorqueScheduler:
     return template.format(nodes=nodes, ppn=ppn, walltime=walltime, job_file=job_file)
 
   @staticmethod
-  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: io.TextIOBase, parameters: dict) -> Tuple[str,str]:
-    cmd = f"qsub {script_path.absolute()} -d {work_dir.absolute()} -o {log_dir.absolute()} -e {log_dir.absolute()}"
-    log.write(f"cmd: {cmd}\ntime: {datetime.datetime.now()}")
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
+  def submit_job(script_path: pathlib.Path, work_dir: pathlib.Path, log_dir: pathlib.Path, log: eventlog.EventLog, parameters: dict) -> Tuple[str,str]:
+    cmd = ["qsub", str(script_path.absolute()), "-d", str(work_dir.absolute()), "-o", str(log_dir.absolute()), "-e", str(log_dir.absolute())]
+    started = time.time()
+    result = runner.run(cmd, retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False)
     output = result.stdout.decode()
+    log.command(cmd, result.returncode, time.time() - started)
     if result.returncode != 0:
-      log.write(f"rc is not zero: {result.returncode} {output}")
-      raise Exception(f"rc is not zero: {output}")
+      log.event("error", message=f"rc is not zero: {result.returncode}", output=output + result.stderr.decode())
+      raise Exception(f"rc is not zero: {output}{result.stderr.decode()}")
     job_id = output.splitlines()[-1]
-    log.write(f"job_id: {job_id}")
+    cache.invalidate("torque")
     return (job_id, output)
 
   @staticmethod
   def all_status() -> str:
-    cmd = "qstat && pbsnodes -a"
-    result = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE)
-    return result.stdout.decode()
+    result = runner.run(["qstat"])
+    if result.returncode != 0:
+      return result.stdout.decode()
+    return result.stdout.decode() + runner.run(["pbsnodes", "-a"]).stdout.decode()
 
   @staticmethod
   def multiple_status(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
-    cmd = "qstat"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
-    output_list = result.stdout.decode().splitlines()
+    index = status.query_index("torque", TorqueScheduler._queue_index, job_ids)
+    return status.lookup(job_ids, index, TorqueScheduler._parse_status, "not found in qstat")
 
-    results = {}
-    for job_id in job_ids:
-      pattern = re.compile(f"^\\s*{job_id}")
-      matched = [line for line in output_list if pattern.match(line)]
-      if matched:
-        results[job_id] = TorqueScheduler._parse_status(matched[-1])
-      else:
-        results[job_id] = ("finished", "not found in qstat")
-    return results
+  @staticmethod
+  def queue_depth() -> int:
+    return status.queue_depth("torque", TorqueScheduler._queue_index, TorqueScheduler._parse_status)
+
+  # error messages printed for ids that are no longer in the queue
+  _UNKNOWN_JOB = re.compile(r'Unknown Job Id')
+
+  @staticmethod
+  def _queue_index(job_ids: Optional[List[str]] = None) -> Dict[str,str]:
+    if job_ids is None:
+      # the jobs of the user are selected by the server, then queried by their ids, since "qstat -u" prints
+      # another format. A job finishing between the two commands is not found, so it is reported finished.
+      result = runner.run(["qselect", "-u", getpass.getuser()], check=True)
+      job_ids = result.stdout.decode().split()
+    index = {}
+    for chunk in status.chunks(job_ids):
+      cmd = ["qstat"] + chunk
+      output = status.run_query(cmd, TorqueScheduler._UNKNOWN_JOB)
+      index.update(status.index_lines(output.splitlines()))
+    return index
+
+  # state codes in the "S" column of qstat. A job in the queue with an unknown state is regarded as running.
+  _STATES = {
+    "Q": "queued", "W": "queued", "H": "queued",
+    "R": "running", "E": "running", "T": "running", "S": "running",
+    "C": "finished"
+  }
 
   @staticmethod
   def _parse_status(line: str) -> Tuple[str,str]:
-    c = line.split()[4]
-    if c == 'Q':
-      return ("queued", line)
-    elif c == 'R' or c == 'T' or c == 'E':
-      return ("running", line)
-    elif c == 'C':
-      return ("finished", line)
-    else:
-      raise Exception(f"unknown format {str}")
+    # columns are "Job ID", "Name", "User", "Time Use", "S", and "Queue". Names never contain spaces.
+    cols = line.split()
+    c = cols[4] if len(cols) > 4 else ""
+    return (TorqueScheduler._STATES.get(c, "running"), line)
 
   @staticmethod
   def delete(job_id: str) -> str:
-    cmd = f"qdel {job_id}"
-    result = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+    result = runner.run(["qdel", job_id], check=True)
+    cache.invalidate("torque")
     return result.stdout.decode()
+
+  @staticmethod
+  def delete_multiple(job_ids: List[str]) -> Dict[str,Tuple[str,str]]:
+    results = status.run_cancel("qdel", job_ids, TorqueScheduler._UNKNOWN_JOB)
+    cache.invalidate("torque")
+    return results
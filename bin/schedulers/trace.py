@@ -0,0 +1,75 @@
+import os,sys,json,time,atexit,contextlib
+from typing import List,Optional,Union
+from . import context
+
+# Opt-in tracing of the commands. When XSUB_TRACE is set to a file path (or `--trace` is given),
+# the wall time of each phase and each external command is appended to that file as JSON lines.
+# Each record is written by a single write(2) on a file opened with O_APPEND, so concurrent processes do not interleave.
+# Use `xtrace` to summarize the records.
+
+_path = None
+_started = time.perf_counter()
+
+def enabled() -> bool:
+  return _path is not None
+
+def configure(path: str) -> None:
+  global _path
+  first = _path is None
+  _path = path
+  os.environ['XSUB_TRACE'] = path   # inherited by the child processes
+  if first:
+    startup = _process_age()
+    if startup is not None:
+      record({"type": "phase", "name": "startup", "duration_s": startup})
+    atexit.register(lambda: record({"type": "phase", "name": "total", "duration_s": time.perf_counter() - _started + (startup or 0.0)}))
+
+def _process_age():
+  # seconds since this process started, i.e. the interpreter startup until this module is imported. Linux only.
+  try:
+    with open("/proc/self/stat") as f:
+      start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+    with open("/proc/uptime") as f:
+      uptime = float(f.read().split()[0])
+    return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+  except (OSError, ValueError, IndexError):
+    return None
+
+def record(event: dict) -> None:
+  if _path is None:
+    return
+  # the type of the backend working in this thread, e.g. "slurm" rather than "multi"
+  xsub_type = (context.environ() or os.environ).get('XSUB_TYPE', '').lower()
+  event = dict(event, time=time.time(), pid=os.getpid(), entry=os.path.basename(sys.argv[0]), xsub_type=xsub_type)
+  if context.backend_name():
+    event["backend"] = context.backend_name()
+  line = (json.dumps(event) + "\n").encode()
+  try:
+    fd = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+      os.write(fd, line)
+    finally:
+      os.close(fd)
+  except OSError as e:
+    print(f"[Warning] failed to write a trace to {_path}: {e}", file=sys.stderr)
+
+@contextlib.contextmanager
+def phase(name: str, **fields):
+  if _path is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    record(dict(fields, type="phase", name=name, duration_s=time.perf_counter() - start))
+
+def command(cmd: Union[str,List[str]], returncode: Optional[int], output_bytes: int, duration: float) -> None:
+  if _path is None:
+    return
+  argv = cmd if isinstance(cmd, list) else ["sh", "-c", cmd]
+  name = argv[0] if isinstance(cmd, list) else cmd.split()[0]
+  record({"type": "command", "name": os.path.basename(name), "argv": [str(a) for a in argv], "returncode": returncode, "output_bytes": output_bytes, "duration_s": duration})
+
+if os.environ.get('XSUB_TRACE'):
+  configure(os.environ['XSUB_TRACE'])
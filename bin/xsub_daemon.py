@@ -0,0 +1,63 @@
+import os,json,socket,getpass
+from typing import Optional
+
+# Client side of xsubd, which keeps the scheduler loaded and serves the requests of xsub, xstat, and xdel
+# over a Unix domain socket. The commands call `request`, which returns None when no daemon is listening
+# so that they fall back to running the operation by themselves.
+# This module is imported on every call of the commands, so it imports as little as possible.
+
+def socket_path() -> str:
+  if os.environ.get('XSUB_DAEMON_SOCKET'):
+    return os.environ['XSUB_DAEMON_SOCKET']
+  xsub_type = os.environ.get('XSUB_TYPE', '').lower()
+  return os.path.join(os.path.expanduser('~'), '.xsub', f"xsubd_{xsub_type}_{getpass.getuser()}.sock")
+
+# variables configuring the client itself. The others must be the same for the client and xsubd.
+CLIENT_VARIABLES = ("XSUB_NO_DAEMON", "XSUB_DAEMON_SOCKET", "XSUB_TRACE")
+
+def settings(env) -> dict:
+  # the XSUB_* variables that xsubd has to share with its clients
+  return {k: v for (k,v) in env.items() if k.startswith("XSUB_") and k not in CLIENT_VARIABLES}
+
+def _send(sock: socket.socket, obj) -> None:
+  sock.sendall(json.dumps(obj).encode() + b"\n")
+
+def _receive(sock: socket.socket) -> Optional[dict]:
+  data = b""
+  while not data.endswith(b"\n"):
+    chunk = sock.recv(65536)
+    if not chunk:
+      break
+    data += chunk
+  return json.loads(data) if data else None
+
+def request(command: str, **args) -> Optional[dict]:
+  # the response is a dict like {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+  # the request is served in the environment and working directory of this process. xsubd refuses it
+  # when its XSUB_* variables differ, and the command falls back as well.
+  if os.environ.get('XSUB_NO_DAEMON'):
+    return None
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(socket_path())
+  except OSError:
+    sock.close()
+    return None
+  # once connected, errors are raised instead of falling back, so that a job is never submitted twice
+  with sock:
+    _send(sock, {"command": command, "args": args, "env": dict(os.environ), "cwd": os.getcwd()})
+    response = _receive(sock)
+  if response is None:
+    raise Exception("xsubd closed the connection without a response")
+  if response.get("refused"):
+    return None
+  return response
+
+def alive(path: str) -> bool:
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  with sock:
+    try:
+      sock.connect(path)
+      return True
+    except OSError:
+      return False
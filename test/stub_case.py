@@ -0,0 +1,46 @@
+import os,sys,json,pathlib,tempfile,subprocess,unittest
+
+# Base of the automated checks. They run the commands against the fake scheduler commands in bench/stubs,
+# with HOME and the state of the stubs in a temporary directory, so they never touch a real scheduler.
+#   python3 -m unittest discover -s test
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+BIN_DIR = ROOT.joinpath("bin")
+STUB_DIR = ROOT.joinpath("bench", "stubs")
+
+class StubTestCase(unittest.TestCase):
+
+  xsub_type = "slurm"
+
+  def setUp(self):
+    self._tmp = tempfile.TemporaryDirectory()
+    self.dir = pathlib.Path(self._tmp.name)
+    self.env = {k: v for (k,v) in os.environ.items() if not k.startswith("XSUB_")}
+    self.env.update({
+      "HOME": str(self.dir),
+      "PATH": f"{STUB_DIR}:{BIN_DIR}:{os.environ.get('PATH', '')}",
+      "PYTHONPATH": str(BIN_DIR),
+      "XSUB_TYPE": self.xsub_type,
+      "XSUB_STUB_DIR": str(self.dir),
+      "XSUB_STUB_QUEUE_SIZE": "20",
+      "XSUB_NO_DAEMON": "1",
+      "XSUB_COMMAND_RETRIES": "0",
+    })
+    self.dir.joinpath("job.sh").write_text("echo hello\n")
+
+  def tearDown(self):
+    self._tmp.cleanup()
+
+  def run_command(self, *argv, input=None, **env) -> subprocess.CompletedProcess:
+    return subprocess.run([str(a) for a in argv], env=dict(self.env, **env), cwd=self.dir, input=input, capture_output=True, text=True, timeout=60)
+
+  def run_json(self, *argv, **env):
+    result = self.run_command(*argv, **env)
+    self.assertTrue(result.stdout, result.stderr)
+    return json.loads(result.stdout)
+
+  def run_python(self, code: str, **env):
+    # runs `code` in a new interpreter with bin/ importable. It prints its result as JSON.
+    result = self.run_command(sys.executable, "-c", code, **env)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    return json.loads(result.stdout)
@@ -0,0 +1,88 @@
+import os,json,unittest
+from stub_case import StubTestCase
+
+class BatchTest(StubTestCase):
+
+  def submit_batch(self, entries: list, **env):
+    log = self.dir.joinpath("stub.log")
+    batch = "".join(json.dumps(dict({"job_script": "job.sh"}, **e)) + "\n" for e in entries)
+    result = self.run_command("xsub", "-b", "-", input=batch, XSUB_STUB_LOG=str(log), **env)
+    calls = [json.loads(l) for l in log.read_text().splitlines()] if log.exists() else []
+    return (result, [json.loads(l) for l in result.stdout.splitlines()], calls)
+
+  def test_grouped_by_parameters_and_log_dir(self):
+    a, b = {"mpi_procs": 2, "ppn": 2}, {"mpi_procs": 4, "ppn": 4}
+    entries = [
+      {"dir": "w0", "parameters": a}, {"dir": "w1", "parameters": b}, {"dir": "w2", "parameters": a},
+      {"dir": "w3", "parameters": a, "log": "other"}, {"dir": "w4", "parameters": a},
+    ]
+    result, outputs, calls = self.submit_batch(entries)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    # the first group (w0, w2, w4) is an array, and the others single jobs, submitted in the order of the groups
+    self.assertEqual([o["job_id"] for o in outputs], ["11000001_0", "11000002", "11000001_1", "11000003", "11000001_2"])
+    self.assertEqual([c[0] for c in calls], ["sbatch"] * 3)
+    self.assertEqual(calls[0][1], "--array=0-2")
+    self.assertFalse(any(c[1].startswith("--array") for c in calls[1:]))
+    self.assertTrue(all(o["parent_script"].startswith(str(self.dir.joinpath(f"w{i}"))) for (i,o) in enumerate(outputs)))
+
+  def test_array_ids_of_each_backend(self):
+    expected = {
+      "slurm": ("sbatch", "--array=0-2", ["11000001_0", "11000001_1", "11000001_2"]),
+      "pbs_pro": ("qsub", "-J", ["11000001[0].bench", "11000001[1].bench", "11000001[2].bench"]),
+      "fugaku": ("pjsub", "--bulk", ["11000001[0]", "11000001[1]", "11000001[2]"]),
+    }
+    for (xsub_type,(command,option,job_ids)) in expected.items():
+      with self.subTest(xsub_type=xsub_type):
+        self.dir.joinpath("stub.log").unlink(missing_ok=True)
+        self.dir.joinpath(f"xsub_stub_counter_{os.getuid()}").unlink(missing_ok=True)
+        result, outputs, calls = self.submit_batch([{"dir": f"{xsub_type}{i}"} for i in range(3)], XSUB_TYPE=xsub_type)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual([o["job_id"] for o in outputs], job_ids)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((calls[0][0], calls[0][1]), (command, option))
+
+  def test_arrays_are_split_by_size(self):
+    result, outputs, calls = self.submit_batch([{"dir": f"w{i}"} for i in range(3)], XSUB_MAX_ARRAY_SIZE="2")
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertEqual([o["job_id"] for o in outputs], ["11000001_0", "11000001_1", "11000002"])
+    self.assertEqual([c[1] for c in calls], ["--array=0-1", "-D"])
+
+  def test_jobs_one_by_one_without_arrays(self):
+    result, outputs, calls = self.submit_batch([{"dir": f"w{i}"} for i in range(3)], XSUB_TYPE="torque")
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertEqual([o["job_id"] for o in outputs], ["11000001.bench", "11000002.bench", "11000003.bench"])
+    self.assertEqual([c[0] for c in calls], ["qsub"] * 3)
+
+  def test_invalid_entry_submits_nothing(self):
+    result, outputs, calls = self.submit_batch([{"dir": "w0"}, {"dir": "w1", "parameters": {"mpi_procs": 0}}])
+    self.assertNotEqual(result.returncode, 0)
+    self.assertIn("invalid entry 1", result.stderr)
+    self.assertEqual(calls, [])
+
+  def test_failed_submission_is_reported_per_job(self):
+    result, outputs, calls = self.submit_batch([{"dir": "w0"}, {"dir": "w1"}], XSUB_STUB_FAIL="sbatch=sbatch: error: Batch job submission failed")
+    self.assertEqual(result.returncode, 1)
+    self.assertEqual(len(outputs), 2)
+    self.assertTrue(all("Batch job submission failed" in o.get("error", "") for o in outputs), outputs)
+
+  def test_status_of_array_elements_by_id(self):
+    # the elements are queried by their ids in a single command, and are finished since the stub never lists them
+    job_ids = [f"11000001_{i}" for i in range(3)]
+    log = self.dir.joinpath("stub.log")
+    out = self.run_json("xstat", "-m", *job_ids, XSUB_STUB_LOG=str(log))
+    self.assertEqual({o["status"] for o in out.values()}, {"finished"})
+    [call] = [json.loads(l) for l in log.read_text().splitlines()]
+    self.assertEqual(call[-2:], ["-j", ",".join(job_ids)])
+
+  def test_query_chunks(self):
+    out = self.run_python('''if True:
+      import json
+      from schedulers import status
+      ids = [str(1000000 + i) for i in range(5)] + ["1000000"]
+      print(json.dumps([list(status.chunks(ids, max_chars=16)), list(status.chunks(ids))]))''')
+    small, default = out
+    self.assertEqual(small, [["1000000", "1000001"], ["1000002", "1000003"], ["1000004"]])
+    self.assertEqual(default, [[str(1000000 + i) for i in range(5)]])
+
+if __name__ == "__main__":
+  unittest.main()
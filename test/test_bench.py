@@ -0,0 +1,26 @@
+import os,json,unittest
+from stub_case import StubTestCase, ROOT, STUB_DIR
+
+class BenchTest(StubTestCase):
+
+  def test_stub_commands(self):
+    for name in ("sbatch", "squeue", "scancel", "qsub", "qstat", "qselect", "qdel", "pjsub", "pjstat", "pjdel"):
+      with self.subTest(name=name):
+        self.assertTrue(os.access(STUB_DIR.joinpath(name), os.X_OK))
+    lines = self.run_command("squeue", "-h", "-o", "%i %t", XSUB_STUB_QUEUE_SIZE="4").stdout.splitlines()
+    self.assertEqual(lines, ["1000000 R", "1000001 PD", "1000002 R", "1000003 CG"])
+    failed = self.run_command("scancel", "1", XSUB_STUB_FAIL="sbatch=x;scancel=scancel: error: down")
+    self.assertEqual((failed.returncode, failed.stderr), (1, "scancel: error: down\n"))
+
+  def test_small_run(self):
+    out = self.dir.joinpath("bench.jsonl")
+    result = self.run_command("python3", ROOT.joinpath("bench", "run.py"), "-q", "20", "-i", "1", "3", "-j", "2", "-n", "1", "-o", out)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    records = [json.loads(l) for l in out.read_text().splitlines()]
+    self.assertEqual(len(records), 4 * (2 * 2 + 1))   # backends * (id counts * (xstat, xdel) + batch sizes)
+    self.assertEqual({r["command"] for r in records}, {"xstat -m", "xdel -m", "xsub --batch"})
+    self.assertTrue(all(r["latency_s"]["p50"] > 0 for r in records))
+    self.assertFalse(self.dir.joinpath(".xsub").exists())   # the benchmark has its own HOME
+
+if __name__ == "__main__":
+  unittest.main()
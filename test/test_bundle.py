@@ -0,0 +1,61 @@
+import json,unittest
+from stub_case import StubTestCase, BIN_DIR
+
+class BundleTest(StubTestCase):
+
+  def submit_batch(self, n: int, parameters: dict, **env):
+    batch = "".join(json.dumps({"job_script": "job.sh", "dir": f"w{i}", "parameters": parameters}) + "\n" for i in range(n))
+    result = self.run_command("xsub", "-b", "-", input=batch, XSUB_BUNDLE_SIZE=str(n), **env)
+    return (result.returncode, [json.loads(l) for l in result.stdout.splitlines()])
+
+  def test_bundle_lifecycle(self):
+    # two runs of 2 cores at a time on a node of 4 cores, so the three runs take two waves
+    rc, outputs = self.submit_batch(3, {"mpi_procs": 2, "ppn": 2, "walltime": "1:00:00"}, XSUB_BUNDLE_NODE_CORES="4")
+    self.assertEqual(rc, 0, outputs)
+    job_ids = [o["job_id"] for o in outputs]
+    self.assertEqual(job_ids, ["bundle-11000001-0", "bundle-11000001-1", "bundle-11000001-2"])
+    [index] = list(self.dir.joinpath(".xsub", "bundles").iterdir())
+    bundle_dir = self.dir.joinpath(index.read_text())
+    manifest = json.loads(bundle_dir.joinpath("manifest.json").read_text())
+    self.assertEqual((manifest["width"], manifest["cores_per_run"]), (2, 2))
+    script = bundle_dir.joinpath("xsub_bundle.sh").read_text()
+    for line in ("#SBATCH --nodes=1", "#SBATCH --ntasks-per-node=4", "#SBATCH --time=2:00:00"):
+      self.assertIn(line, script)
+
+    result = self.run_command("python3", BIN_DIR.joinpath("xsub_bundle_run"), bundle_dir)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertEqual([bundle_dir.joinpath(f"{i}.status").read_text() for i in range(3)], ["finished 0\n"] * 3)
+    self.assertEqual(bundle_dir.joinpath("0.log").read_text(), "hello\n")
+
+    # the stub does not list the allocation, so it is finished. All the runs are finished, so its index entry is removed
+    out = self.run_json("xstat", "-m", *job_ids)
+    self.assertEqual({o["status"] for o in out.values()}, {"finished"})
+    self.assertFalse(index.exists())
+    self.assertEqual(self.run_json("xstat", "-m", job_ids[0])[job_ids[0]]["status"], "finished")
+
+  def test_unfinished_runs_are_confirmed(self):
+    rc, outputs = self.submit_batch(2, {}, XSUB_BUNDLE_NODE_CORES="1")
+    self.assertEqual(rc, 0, outputs)
+    job_ids = [o["job_id"] for o in outputs]
+    [index] = list(self.dir.joinpath(".xsub", "bundles").iterdir())
+    # the runs have not started, so the entry is kept until the allocation is seen finished again
+    out = self.run_json("xstat", "-m", *job_ids)
+    self.assertIn("ended before the run finished", out[job_ids[0]]["raw_output"])
+    self.assertTrue(index.exists())
+    self.run_json("xstat", "-m", *job_ids)
+    self.assertEqual(list(index.parent.iterdir()), [])
+
+  def test_width_is_capped_by_processes_per_node(self):
+    out = self.run_python('''if True:
+      import json
+      from schedulers import bundle
+      print(json.dumps(bundle.allocation({"mpi_procs": 1, "omp_threads": 12, "max_mpi_procs_per_node": 4, "elapse": "0:30:00", "node": "1"}, 5)))''', XSUB_BUNDLE_NODE_CORES="48")
+    self.assertEqual(out, [{"mpi_procs": 4, "omp_threads": 12, "max_mpi_procs_per_node": 4, "elapse": "1:00:00", "node": "1"}, 4])
+
+  def test_multiple_nodes_are_rejected(self):
+    rc, outputs = self.submit_batch(2, {"mpi_procs": 8, "ppn": 4})
+    self.assertEqual(rc, 1)
+    self.assertTrue(all("single node" in o["error"] for o in outputs), outputs)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,56 @@
+import json,subprocess,time,unittest
+from stub_case import StubTestCase
+
+class StatusCacheTest(StubTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.log = self.dir.joinpath("stub.log")
+    self.env.update({"XSUB_STATUS_CACHE_TTL": "30", "XSUB_STUB_LOG": str(self.log)})
+
+  def squeue_calls(self):
+    return [c for c in map(json.loads, self.log.read_text().splitlines()) if c[0] == "squeue"] if self.log.exists() else []
+
+  def status(self, job_id: str, *options, **env) -> str:
+    return self.run_json("xstat", *options, "-m", job_id, **env)[job_id]["status"]
+
+  def test_snapshot_is_shared(self):
+    self.assertEqual(self.status("1000001"), "queued")
+    self.assertEqual(self.status("1000002"), "running")
+    [call] = self.squeue_calls()
+    self.assertIn("-u", call)   # the whole queue of the user, not the requested id
+
+  def test_snapshot_expires(self):
+    self.status("1000001", XSUB_STATUS_CACHE_TTL="0.2")
+    time.sleep(0.3)
+    self.status("1000001", XSUB_STATUS_CACHE_TTL="0.2")
+    self.assertEqual(len(self.squeue_calls()), 2)
+
+  def test_submission_invalidates_snapshot(self):
+    self.status("1000001")
+    self.run_json("xsub", "job.sh")
+    self.status("1000001")
+    self.assertEqual(len(self.squeue_calls()), 2)
+
+  def test_no_cache_queries_scheduler(self):
+    self.status("1000001")
+    self.status("1000001", "--no-cache")
+    self.status("1000001")
+    self.assertEqual(len(self.squeue_calls()), 2)
+
+  def test_broken_snapshot_is_fetched_again(self):
+    self.status("1000001")
+    [path] = self.dir.joinpath(".xsub", "cache").glob("status_slurm_*.json")
+    path.write_text("{")
+    self.assertEqual(self.status("1000001"), "queued")
+    self.assertEqual(len(self.squeue_calls()), 2)
+
+  def test_concurrent_callers_query_once(self):
+    env = dict(self.env, XSUB_STUB_LATENCY="0.5")
+    procs = [subprocess.Popen(["xstat", "-m", "1000001"], env=env, cwd=self.dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE) for _ in range(6)]
+    outputs = [p.communicate(timeout=60)[0] for p in procs]
+    self.assertEqual({json.loads(o)["1000001"]["status"] for o in outputs}, {"queued"})
+    self.assertEqual(len(self.squeue_calls()), 1)
+
+if __name__ == "__main__":
+  unittest.main()
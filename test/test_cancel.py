@@ -0,0 +1,29 @@
+import unittest
+from stub_case import StubTestCase
+
+class CancelTest(StubTestCase):
+
+  def test_deleted(self):
+    result = self.run_command("xdel", "-m", "1000001", "1000002")
+    self.assertEqual(result.returncode, 0, result.stderr)
+
+  def test_failure_without_job_ids(self):
+    # the error names no job, e.g. the controller is down. No job may be reported as deleted.
+    out = self.run_json("xdel", "-m", "1000001", "1000002", XSUB_STUB_FAIL="scancel=scancel: error: Unable to contact slurm controller")
+    for job_id in ("1000001", "1000002"):
+      self.assertEqual(out[job_id]["result"], "error")
+      self.assertIn("Unable to contact", out[job_id]["raw_output"])
+
+  def test_failure_naming_some_job_ids(self):
+    # the job named as unknown is not in the queue anymore, and the job not named is cancelled
+    out = self.run_json("xdel", "-m", "1000001", "1000002", XSUB_STUB_FAIL="scancel=scancel: error: Kill job error on job id 1000001: Invalid job id specified")
+    self.assertEqual(out["1000001"], {"result": "finished", "raw_output": "scancel: error: Kill job error on job id 1000001: Invalid job id specified"})
+    self.assertEqual(out["1000002"]["result"], "deleted")
+
+  def test_failure_of_named_job(self):
+    out = self.run_json("xdel", "-m", "1000001", "1000002", XSUB_STUB_FAIL="scancel=scancel: error: Kill job error on job id 1000002: Access/permission denied")
+    self.assertEqual(out["1000001"]["result"], "deleted")
+    self.assertEqual(out["1000002"], {"result": "error", "raw_output": "scancel: error: Kill job error on job id 1000002: Access/permission denied"})
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,48 @@
+import os,json,time,subprocess,unittest
+from stub_case import StubTestCase
+
+class DaemonTest(StubTestCase):
+
+  def setUp(self):
+    super().setUp()
+    sock = self.dir.joinpath("xsubd.sock")
+    self.env["XSUB_DAEMON_SOCKET"] = str(sock)
+    daemon_env = {k: v for (k,v) in self.env.items() if k != "XSUB_NO_DAEMON"}
+    self.daemon = subprocess.Popen(["xsubd"], env=daemon_env, cwd="/", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+      if sock.exists():
+        break
+      time.sleep(0.05)
+    self.assertTrue(sock.exists(), "xsubd did not start")
+    del self.env["XSUB_NO_DAEMON"]
+
+  def tearDown(self):
+    self.daemon.terminate()
+    self.daemon.wait()
+    super().tearDown()
+
+  def test_request_in_client_directory_and_environment(self):
+    # the fake sbatch in the PATH of the client is used, and the relative paths are resolved in its directory
+    bin_dir = self.dir.joinpath("client_bin")
+    bin_dir.mkdir()
+    bin_dir.joinpath("sbatch").write_text("#!/bin/sh\necho Submitted batch job 42\n")
+    bin_dir.joinpath("sbatch").chmod(0o755)
+    work = self.dir.joinpath("work")
+    work.mkdir()
+    work.joinpath("run.sh").write_text("echo hi\n")
+    batch = json.dumps({"job_script": "run.sh"}) + "\n"
+    result = subprocess.run(["xsub", "-b", "-"], input=batch, env=dict(self.env, PATH=f"{bin_dir}:{self.env['PATH']}"), cwd=work, capture_output=True, text=True, timeout=60)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    out = json.loads(result.stdout)
+    self.assertEqual(out["job_id"], "42")
+    self.assertEqual(os.path.dirname(out["parent_script"]), str(work))
+
+  def test_refused_when_settings_differ(self):
+    # the daemon runs without the registry, so the registry is written only if the command runs by itself
+    registry = self.dir.joinpath("registry.sqlite")
+    job_id = self.run_json("xsub", "job.sh", XSUB_REGISTRY=str(registry))["job_id"]
+    self.assertTrue(job_id)
+    self.assertTrue(registry.exists())
+
+if __name__ == "__main__":
+  unittest.main()
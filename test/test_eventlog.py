@@ -0,0 +1,75 @@
+import json,subprocess,sys,unittest
+from stub_case import StubTestCase
+
+class EventLogTest(StubTestCase):
+
+  def write_events(self, n: int, **env):
+    return self.run_python(f'''if True:
+      import pathlib
+      from schedulers import eventlog
+      with eventlog.open_log(pathlib.Path("logs")) as log:
+        for i in range({n}):
+          log.event("message", text=str(i), padding="x" * 40)
+      print("null")''', **env)
+
+  def records(self, name: str) -> list:
+    return [json.loads(l) for l in self.dir.joinpath("logs", name).read_text().splitlines()]
+
+  def test_rotation_by_size(self):
+    self.dir.joinpath("logs").mkdir()
+    self.write_events(30, XSUB_LOG_MAX_BYTES="500", XSUB_LOG_BACKUPS="2")
+    names = sorted(p.name for p in self.dir.joinpath("logs").iterdir() if not p.name.endswith(".lock"))
+    self.assertEqual(names, ["xsub.log", "xsub.log.1", "xsub.log.2"])
+    for name in names:
+      self.assertLessEqual(self.dir.joinpath("logs", name).stat().st_size, 500)
+    texts = [r["text"] for name in reversed(names) for r in self.records(name)]
+    self.assertEqual(texts, [str(i) for i in range(30 - len(texts), 30)])   # the newest records, in order
+
+  def test_concurrent_appenders(self):
+    self.dir.joinpath("logs").mkdir()
+    code = '''if True:
+      import pathlib
+      from schedulers import eventlog
+      with eventlog.open_log(pathlib.Path("logs")) as log:
+        for i in range(200):
+          log.event("message", text=TAG + str(i), padding="x" * 40)'''
+    procs = [subprocess.Popen([sys.executable, "-c", f"TAG = 'w{w}-'\n" + code], env=self.env, cwd=self.dir) for w in range(6)]
+    for p in procs:
+      self.assertEqual(p.wait(timeout=60), 0)
+    texts = [r["text"] for r in self.records("xsub.log")]
+    self.assertEqual(sorted(texts), sorted(f"w{w}-{i}" for w in range(6) for i in range(200)))
+
+  def test_concurrent_appenders_with_rotation(self):
+    # the writers reopen the file rotated by the others, so no record goes to a file that is not the newest
+    self.dir.joinpath("logs").mkdir()
+    env = dict(self.env, XSUB_LOG_MAX_BYTES="2000", XSUB_LOG_BACKUPS="100")
+    code = '''if True:
+      import pathlib
+      from schedulers import eventlog
+      with eventlog.open_log(pathlib.Path("logs")) as log:
+        for i in range(100):
+          log.event("message", text=TAG + str(i), padding="x" * 40)'''
+    procs = [subprocess.Popen([sys.executable, "-c", f"TAG = 'w{w}-'\n" + code], env=env, cwd=self.dir) for w in range(4)]
+    for p in procs:
+      self.assertEqual(p.wait(timeout=60), 0)
+    files = [p for p in self.dir.joinpath("logs").iterdir() if not p.name.endswith(".lock")]
+    texts = [r["text"] for p in files for r in self.records(p.name)]
+    self.assertEqual(sorted(texts), sorted(f"w{w}-{i}" for w in range(4) for i in range(100)))
+    for p in files:
+      self.assertLessEqual(p.stat().st_size, 2000 + 200, p.name)   # a file may get one more record per writer
+
+  def test_reopened_after_rotation_by_another_writer(self):
+    out = self.run_python('''if True:
+      import os,json,pathlib
+      from schedulers import eventlog
+      os.makedirs("logs")
+      log = eventlog.EventLog(pathlib.Path("logs", "xsub.log"))
+      log.event("message", text="before")
+      os.replace("logs/xsub.log", "logs/xsub.log.1")   # as another process rotating the file
+      log.event("message", text="after")
+      log.close()
+      print(json.dumps([[json.loads(l)["text"] for l in open(p)] for p in ("logs/xsub.log", "logs/xsub.log.1")]))''')
+    self.assertEqual(out, [["after"], ["before"]])
+
+if __name__ == "__main__":
+  unittest.main()
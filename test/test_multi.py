@@ -0,0 +1,36 @@
+import json,unittest
+from stub_case import StubTestCase
+
+class MultiTest(StubTestCase):
+
+  xsub_type = "multi"
+
+  def setUp(self):
+    super().setUp()
+    config = {"backends": {
+      "a": {"type": "slurm"},
+      "b": {"type": "torque", "env": {"XSUB_STUB_QUEUE_SIZE": "2"}},
+    }}
+    self.dir.joinpath("multi.json").write_text(json.dumps(config))
+    self.env["XSUB_MULTI_CONFIG"] = str(self.dir.joinpath("multi.json"))
+
+  def test_routed_to_least_loaded_backend(self):
+    # b has 2 jobs in its queue, and a has 20
+    self.assertEqual(self.run_json("xsub", "job.sh")["job_id"], "b:11000001.bench")
+    self.assertEqual(self.run_json("xsub", "job.sh", "-p", '{"backend": "a"}')["job_id"], "a:11000002")
+
+  def test_status_of_each_backend(self):
+    out = self.run_json("xstat", "-m", "a:1000001", "b:1000001", "a:1000019", "b:1000019", "c:1")
+    self.assertEqual(out["a:1000001"]["status"], "queued")
+    self.assertEqual(out["b:1000001"]["status"], "queued")
+    self.assertEqual(out["a:1000019"]["status"], "running")
+    self.assertEqual(out["b:1000019"]["status"], "finished")   # beyond the queue of b
+    self.assertIn("unknown backend", out["c:1"]["raw_output"])
+
+  def test_unreachable_backend_is_an_error(self):
+    result = self.run_command("xstat", "-m", "a:1000001", "b:1000001", XSUB_STUB_FAIL="qstat=qstat: cannot connect to server")
+    self.assertNotEqual(result.returncode, 0)
+    self.assertIn("backend b", result.stderr)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,79 @@
+import os,json,time,unittest
+from stub_case import StubTestCase
+
+class NoneSchedulerTest(StubTestCase):
+
+  xsub_type = "none"
+
+  def setUp(self):
+    super().setUp()
+    self.env["XSUB_NONE_DIR"] = str(self.dir.joinpath("none"))
+    self.queue_file = self.dir.joinpath("none", "queue.json")
+
+  def queue(self) -> dict:
+    return json.loads(self.queue_file.read_text())
+
+  def wait_for(self, job_id: str, status: str, timeout: float = 10) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      if self.run_json("xstat", "-m", job_id)[job_id]["status"] == status:
+        return
+      time.sleep(0.1)
+    self.fail(f"{job_id} did not become {status}")
+
+  def test_job_runs_in_submitter_environment(self):
+    self.dir.joinpath("env.sh").write_text('echo "$XSUB_TEST_VALUE" > value.txt\n')
+    job_id = self.run_json("xsub", "env.sh", "-d", "work", XSUB_TEST_VALUE="from the submitter")["job_id"]
+    self.wait_for(job_id, "finished")
+    self.assertEqual(self.dir.joinpath("work", "value.txt").read_text(), "from the submitter\n")
+    self.assertEqual(list(self.dir.joinpath("none").glob("*.env")), [])
+    self.assertEqual(self.dir.joinpath("none").stat().st_mode & 0o777, 0o700)
+
+  def test_environment_of_queued_job_is_private(self):
+    self.dir.joinpath("sleep.sh").write_text("sleep 3\n")
+    first = self.run_json("xsub", "sleep.sh", XSUB_NONE_CORES="1")["job_id"]
+    second = self.run_json("xsub", "job.sh", XSUB_NONE_CORES="1", XSUB_TEST_SECRET="s3cret")["job_id"]
+    self.assertEqual(self.run_json("xstat", "-m", second)[second]["status"], "queued")
+    env_file = self.dir.joinpath("none", f"{second}.env")
+    self.assertEqual(env_file.stat().st_mode & 0o777, 0o600)
+    self.assertEqual(json.loads(env_file.read_text())["XSUB_TEST_SECRET"], "s3cret")
+    self.assertNotIn("s3cret", self.queue_file.read_text())
+    self.run_json("xdel", "-m", first, second)
+    self.assertFalse(env_file.exists())
+
+  def test_queue_file_is_not_rewritten_while_nothing_changes(self):
+    self.dir.joinpath("sleep.sh").write_text("sleep 3\n")
+    job_id = self.run_json("xsub", "sleep.sh")["job_id"]
+    self.wait_for(job_id, "running")
+    mtime = self.queue_file.stat().st_mtime_ns
+    time.sleep(1.2)   # a few polls of the runner
+    self.assertEqual(self.queue_file.stat().st_mtime_ns, mtime)
+    self.run_json("xdel", "-m", job_id)
+
+  def test_old_finished_jobs_are_trimmed(self):
+    old = {"script": "x", "work_dir": str(self.dir), "cores": 1, "state": "finished", "returncode": 0, "submitted_at": 0, "finished_at": 0}
+    self.queue_file.parent.mkdir()
+    self.queue_file.write_text(json.dumps({"next_id": 1, "jobs": {"local-1": old}}))
+    job_id = self.run_json("xsub", "job.sh")["job_id"]
+    self.wait_for(job_id, "finished")
+    deadline = time.time() + 5
+    while "local-1" in self.queue()["jobs"] and time.time() < deadline:
+      time.sleep(0.1)
+    self.assertEqual(list(self.queue()["jobs"]), [job_id])
+    self.assertEqual(self.run_json("xstat", "-m", "local-1")["local-1"]["status"], "finished")
+
+  def test_start_times_are_removed(self):
+    state_dir = self.dir.joinpath("none")
+    state_dir.mkdir()
+    stale = state_dir.joinpath("999999999")   # a process that is gone, recorded long ago
+    stale.write_text("1")
+    os.utime(stale, (0, 0))
+    job_id = self.run_json("xsub", "job.sh")["job_id"]
+    self.wait_for(job_id, "finished")
+    deadline = time.time() + 5
+    while "returncode" not in self.queue()["jobs"][job_id] and time.time() < deadline:
+      time.sleep(0.1)
+    self.assertEqual([p.name for p in state_dir.iterdir() if p.name.isdigit()], [])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,59 @@
+import os,unittest
+from stub_case import StubTestCase
+
+class ParentScriptTest(StubTestCase):
+
+  def submit(self, *args, **env) -> str:
+    return self.run_json("xsub", "job.sh", *args, **env)["parent_script"]
+
+  def test_flat_layout(self):
+    self.assertEqual(self.submit(), str(self.dir.joinpath("job_xsub.sh")))
+    self.assertFalse(self.dir.joinpath(".job_xsub.seq").exists())   # no counter while the name is free
+    self.assertEqual(self.submit(), str(self.dir.joinpath("job_xsub1.sh")))
+    self.assertEqual(self.dir.joinpath(".job_xsub.seq").read_text(), "2")
+    self.assertEqual(self.submit(), str(self.dir.joinpath("job_xsub2.sh")))
+
+  def test_existing_scripts_are_kept(self):
+    # scripts left without a counter, or with a stale one, are skipped
+    for i in range(6):
+      self.dir.joinpath(f"job_xsub{i or ''}.sh").write_text("old\n")
+    self.dir.joinpath(".job_xsub.seq").write_text("2")
+    path = self.submit()
+    self.assertNotIn(os.path.basename(path), [f"job_xsub{i or ''}.sh" for i in range(6)])
+    self.assertEqual([self.dir.joinpath(f"job_xsub{i or ''}.sh").read_text() for i in range(6)], ["old\n"] * 6)
+
+  def test_concurrent_creation(self):
+    out = self.run_python('''if True:
+      import json,pathlib,threading
+      from schedulers import core
+      paths = []
+      def create(i):
+        paths.append(str(core._create_numbered(pathlib.Path("w"), "job", f"script {i}\\n", sharded=False)))
+      threads = [threading.Thread(target=create, args=(i,)) for i in range(20)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+      print(json.dumps(sorted(pathlib.Path(p).read_text() for p in paths)))''')
+    self.assertEqual(out, sorted(f"script {i}\n" for i in range(20)))
+    self.assertEqual(len(list(self.dir.joinpath("w").glob("job_xsub*.sh"))), 20)
+
+  def test_sharded_layout(self):
+    scripts = self.dir.joinpath("xsub_scripts")
+    self.assertEqual(self.submit(XSUB_SCRIPT_LAYOUT="sharded"), str(scripts.joinpath("0", "job_xsub.sh")))
+    scripts.joinpath(".job_xsub.seq").write_text("1000")
+    self.assertEqual(self.submit(XSUB_SCRIPT_LAYOUT="sharded"), str(scripts.joinpath("1", "job_xsub1000.sh")))
+
+  def test_hash_layout(self):
+    store = self.dir.joinpath("store")
+    env = {"XSUB_SCRIPT_LAYOUT": "hash", "XSUB_SCRIPT_STORE": str(store)}
+    first = self.submit(**env)
+    self.assertEqual(self.submit(**env), first)
+    other = self.submit("-p", '{"mpi_procs": 2, "ppn": 2}', **env)
+    self.assertNotEqual(other, first)
+    for path in (first, other):
+      self.assertEqual(os.path.dirname(path), str(store.joinpath(os.path.basename(path)[:2])))
+    self.assertEqual(len(list(store.glob("*/*"))), 2)
+
+if __name__ == "__main__":
+  unittest.main()
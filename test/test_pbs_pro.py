@@ -0,0 +1,25 @@
+import json,getpass,unittest
+from stub_case import StubTestCase
+
+class PBSProQueryTest(StubTestCase):
+
+  xsub_type = "pbs_pro"
+
+  def calls(self, log, command):
+    return [c for c in map(json.loads, log.read_text().splitlines()) if c[0] == command]
+
+  def test_per_id_and_whole_queue_queries_agree(self):
+    # the whole queue is selected by qselect on the server, then queried by the ids like the requested ids
+    ids = ["1000001", "1000002", "999"]
+    log = self.dir.joinpath("stub.log")
+    by_id = self.run_json("xstat", "-m", *ids, XSUB_STUB_LOG=str(log))
+    self.assertEqual(self.calls(log, "qstat")[-1], ["qstat", "-f", "-F", "json", "-x", "-t"] + ids)
+    self.assertEqual(self.calls(log, "qselect"), [])
+    whole = self.run_json("xstat", "-m", *ids, XSUB_STUB_LOG=str(log), XSUB_STATUS_CACHE_TTL="30")
+    self.assertEqual(self.calls(log, "qselect"), [["qselect", "-u", getpass.getuser()]])
+    self.assertEqual(self.calls(log, "qstat")[-1], ["qstat", "-f", "-F", "json", "-x", "-t"] + [f"{1000000 + i}.bench" for i in range(20)])
+    self.assertEqual({j: o["status"] for (j,o) in by_id.items()}, {"1000001": "queued", "1000002": "running", "999": "finished"})
+    self.assertEqual({j: o["status"] for (j,o) in whole.items()}, {j: o["status"] for (j,o) in by_id.items()})
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,31 @@
+import json,unittest
+from stub_case import StubTestCase
+
+# Without the status cache, only the requested ids are sent to the scheduler
+
+class FilteredQueryTest(StubTestCase):
+
+  def test_requested_ids_only(self):
+    expected = {
+      "slurm": ["squeue", "-h", "-r", "-o", "%i %t %M %R", "-j", "1000001,999"],
+      "torque": ["qstat", "1000001", "999"],
+      "pbs_pro": ["qstat", "-f", "-F", "json", "-x", "-t", "1000001", "999"],
+      "fugaku": ["pjstat", "-E", "--choose", "jid,st", "1000001", "999"],
+    }
+    for (xsub_type,cmd) in expected.items():
+      with self.subTest(xsub_type=xsub_type):
+        log = self.dir.joinpath(f"{xsub_type}.log")
+        out = self.run_json("xstat", "-m", "1000001", "999", XSUB_TYPE=xsub_type, XSUB_STUB_LOG=str(log))
+        self.assertEqual(out["1000001"]["status"], "queued")
+        self.assertEqual(out["999"]["status"], "finished")   # e.g. "Unknown Job Id 999" is not an error
+        self.assertEqual([json.loads(l) for l in log.read_text().splitlines()], [cmd])
+
+  def test_other_errors_are_raised(self):
+    # a job must not be reported finished because the scheduler could not be asked
+    result = self.run_command("xstat", "-m", "1000001", XSUB_STUB_FAIL="squeue=slurm_load_jobs error: Unable to contact slurm controller")
+    self.assertNotEqual(result.returncode, 0)
+    self.assertEqual(result.stdout, "")
+    self.assertIn("Unable to contact slurm controller", result.stderr)
+
+if __name__ == "__main__":
+  unittest.main()
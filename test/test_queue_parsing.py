@@ -0,0 +1,40 @@
+import json,getpass,unittest
+from stub_case import StubTestCase
+
+# The stubs print one job of the user (1000000, running) after the headers of the command,
+# and the listings of the whole queue by qstat also have a job of another user (999999), which qselect does not select.
+
+class QueueParsingTest(StubTestCase):
+
+  def queue_depth(self, xsub_type: str, **env) -> int:
+    return self.run_python('''if True:
+      import json,schedulers
+      print(json.dumps(schedulers.create().queue_depth()))''', XSUB_TYPE=xsub_type, XSUB_STUB_QUEUE_SIZE="1", **env)
+
+  def test_queue_depth(self):
+    for xsub_type in ("slurm", "torque", "pbs_pro", "fugaku"):
+      with self.subTest(xsub_type=xsub_type):
+        self.assertEqual(self.queue_depth(xsub_type), 1)
+
+  def test_headers_are_not_jobs(self):
+    for xsub_type in ("torque", "fugaku"):
+      with self.subTest(xsub_type=xsub_type):
+        out = self.run_json("xstat", "-m", "1000000", "Job", "JOB_ID", XSUB_TYPE=xsub_type, XSUB_STATUS_CACHE_TTL="30")
+        self.assertEqual(out["1000000"]["status"], "running")
+        self.assertEqual(out["Job"]["status"], "finished")
+        self.assertEqual(out["JOB_ID"]["status"], "finished")
+
+  def test_jobs_of_other_users_are_ignored(self):
+    for xsub_type in ("torque", "pbs_pro"):
+      with self.subTest(xsub_type=xsub_type):
+        out = self.run_json("xstat", "-m", "999999", XSUB_TYPE=xsub_type, XSUB_STATUS_CACHE_TTL="30")
+        self.assertEqual(out["999999"]["status"], "finished")
+
+  def test_torque_queue_is_selected_on_the_server(self):
+    log = self.dir.joinpath("stub.log")
+    self.assertEqual(self.queue_depth("torque", XSUB_STUB_LOG=str(log)), 1)
+    calls = [json.loads(l) for l in log.read_text().splitlines()]
+    self.assertEqual(calls, [["qselect", "-u", getpass.getuser()], ["qstat", "1000000.bench"]])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,57 @@
+import json,sqlite3,unittest
+from stub_case import StubTestCase
+
+class RegistryTest(StubTestCase):
+
+  def submit(self, **env) -> str:
+    return self.run_json("xsub", "job.sh", **env)["job_id"]
+
+  def squeue_calls(self) -> int:
+    log = self.dir.joinpath("stub.log")
+    return sum(1 for c in map(json.loads, log.read_text().splitlines()) if c[0] == "squeue") if log.exists() else 0
+
+  def test_disabled_by_default(self):
+    job_id = self.submit()
+    self.assertEqual(self.run_json("xstat", "-m", job_id)[job_id]["status"], "finished")
+    self.assertFalse(self.dir.joinpath(".xsub", "registry.sqlite").exists())
+
+  def test_finish_is_stored_after_confirmations(self):
+    env = {"XSUB_REGISTRY": "on", "XSUB_STUB_LOG": str(self.dir.joinpath("stub.log"))}
+    job_id = self.submit(**env)   # the stub never lists the submitted jobs, so they look finished
+    db = self.dir.joinpath(".xsub", "registry.sqlite")
+    def stored():
+      with sqlite3.connect(str(db)) as conn:
+        return conn.execute("SELECT status, misses FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    self.assertEqual(stored(), ("submitted", 0))
+    self.assertEqual(self.run_json("xstat", "-m", job_id, **env)[job_id]["status"], "finished")
+    self.assertEqual(stored(), ("submitted", 1))
+    self.run_json("xstat", "-m", job_id, **env)
+    self.assertEqual(stored(), ("finished", 2))
+    calls = self.squeue_calls()
+    self.assertEqual(self.run_json("xstat", "-m", job_id, **env)[job_id]["status"], "finished")
+    self.assertEqual(self.squeue_calls(), calls)
+
+  def test_live_job_resets_misses(self):
+    env = {"XSUB_REGISTRY": str(self.dir.joinpath("r.sqlite"))}
+    out = self.run_python('''if True:
+      import os,json,schedulers
+      from schedulers import registry
+      registry.record([{"job_id": "1000020", "parent_script": "p.sh", "work_dir": ".", "log_dir": ".", "parameters": {}}])
+      session = schedulers.Session(snapshot_ttl=0)
+      first = session.status("1000020")["status"]
+      os.environ["XSUB_STUB_QUEUE_SIZE"] = "21"
+      second = session.status("1000020")["status"]
+      os.environ["XSUB_STUB_QUEUE_SIZE"] = "20"
+      third = session.status("1000020")["status"]
+      print(json.dumps([first, second, third]))''', **env)
+    self.assertEqual(out, ["finished", "running", "finished"])
+    with sqlite3.connect(env["XSUB_REGISTRY"]) as conn:
+      self.assertEqual(conn.execute("SELECT status, misses FROM jobs").fetchall(), [("submitted", 1)])
+
+  def test_unregistered_job_is_not_confirmed(self):
+    out = self.run_json("xstat", "-m", "999", XSUB_REGISTRY="on")
+    self.assertEqual(out["999"]["status"], "finished")
+    self.assertIn("not in the job registry", out["999"]["raw_output"])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,86 @@
+import json,unittest
+from stub_case import StubTestCase
+
+class RunnerTest(StubTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.env.update({"XSUB_COMMAND_RETRIES": "2", "XSUB_COMMAND_BACKOFF": "0.01"})
+    # fails with the message in $1 until it has been called $2 times, and records each call
+    self.flaky = self.dir.joinpath("flaky")
+    self.flaky.write_text('#!/bin/sh\necho call >> "$0.calls"\n[ "$(wc -l < "$0.calls")" -ge "$2" ] && { echo ok; exit 0; }\necho "$1" >&2\nexit 1\n')
+    self.flaky.chmod(0o755)
+
+  def run_flaky(self, message: str, succeeds_at: int, options: str = "") -> list:
+    # [rc, stdout, number of calls], or the message of the exception
+    return self.run_python(f'''if True:
+      import json
+      from schedulers import runner
+      try:
+        r = runner.run(["{self.flaky}", {message!r}, "{succeeds_at}"]{options})
+        out = [r.returncode, r.stdout.decode()]
+      except Exception as e:
+        out = [str(e)]
+      print(json.dumps(out + [len(open("{self.flaky}.calls").read().splitlines())]))''')
+
+  def test_transient_failure_is_retried(self):
+    self.assertEqual(self.run_flaky("Socket timed out on send/recv operation", 3), [0, "ok\n", 3])
+
+  def test_other_failure_is_not_retried(self):
+    self.assertEqual(self.run_flaky("Invalid job id specified", 3), [1, "", 1])
+
+  def test_retries_are_bounded(self):
+    self.assertEqual(self.run_flaky("Socket timed out", 10), [1, "", 3])
+
+  def test_submission_is_retried_only_before_reaching_the_server(self):
+    options = ", retry_on=runner.CONNECT_ERRORS, retry_on_timeout=False"
+    self.assertEqual(self.run_flaky("Socket timed out", 3, options), [1, "", 1])
+    self.dir.joinpath("flaky.calls").unlink()
+    self.assertEqual(self.run_flaky("Connection refused", 3, options), [0, "ok\n", 3])
+
+  def test_timeout(self):
+    script = self.dir.joinpath("hang")
+    script.write_text('#!/bin/sh\necho call >> "$0.calls"\nexec sleep 10\n')
+    script.chmod(0o755)
+    out = self.run_python(f'''if True:
+      import json
+      from schedulers import runner
+      out = []
+      for retry in (True, False):
+        try:
+          runner.run(["{script}"], retry_on_timeout=retry)
+        except Exception as e:
+          out.append([str(e), len(open("{script}.calls").read().splitlines())])
+      print(json.dumps(out))''', XSUB_COMMAND_TIMEOUT="0.3", XSUB_COMMAND_RETRIES="1")
+    message = f"{script} timed out after 0.3 seconds"
+    self.assertEqual(out, [[message, 2], [message, 3]])   # retried once, then not retried
+
+  def test_arguments_are_not_interpreted_by_a_shell(self):
+    out = self.run_python('''if True:
+      import json
+      from schedulers import runner
+      print(json.dumps(runner.run(["printf", "%s|", "a b", "$HOME", "*"]).stdout.decode()))''')
+    self.assertEqual(out, "a b|$HOME|*|")
+
+  def test_concurrent_commands_are_limited(self):
+    script = self.dir.joinpath("slow")
+    script.write_text('#!/bin/sh\necho "start $(date +%s.%N)" >> "$1"\nsleep 0.3\necho "end $(date +%s.%N)" >> "$1"\n')
+    script.chmod(0o755)
+    events = self.dir.joinpath("events")
+    self.run_python(f'''if True:
+      import threading
+      from schedulers import runner
+      threads = [threading.Thread(target=runner.run, args=(["{script}", "{events}"],)) for _ in range(6)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+      print("null")''', XSUB_MAX_CONCURRENT_COMMANDS="2")
+    running, peak = 0, 0
+    for (_,kind) in sorted((float(t), k) for (k,t) in map(str.split, events.read_text().splitlines())):
+      running += 1 if kind == "start" else -1
+      peak = max(peak, running)
+    self.assertLessEqual(peak, 2)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,48 @@
+import json,sqlite3,unittest
+from stub_case import StubTestCase
+
+class SessionTest(StubTestCase):
+
+  def squeue_calls(self):
+    log = self.dir.joinpath("stub.log")
+    return [c for c in map(json.loads, log.read_text().splitlines()) if c[0] == "squeue"] if log.exists() else []
+
+  def test_snapshot_is_reused(self):
+    out = self.run_python('''if True:
+      import json,schedulers
+      session = schedulers.Session()
+      a = session.multiple_status(["1000001", "1000002"])
+      b = session.multiple_status(["1000001"])
+      print(json.dumps([a, b]))''', XSUB_STUB_LOG=str(self.dir.joinpath("stub.log")))
+    self.assertEqual(out[0]["1000001"], out[1]["1000001"])
+    self.assertEqual(len(self.squeue_calls()), 1)
+
+  def test_job_submitted_after_snapshot(self):
+    # 1000020 enters the queue (as if another process submitted it) after the session took its snapshot
+    registry = self.dir.joinpath("registry.sqlite")
+    out = self.run_python('''if True:
+      import os,json,schedulers
+      from schedulers import registry
+      session = schedulers.Session()
+      registry.record([{"job_id": "1000020", "parent_script": "p.sh", "work_dir": ".", "log_dir": ".", "parameters": {}}])
+      session.multiple_status(["1000001"])
+      os.environ["XSUB_STUB_QUEUE_SIZE"] = "21"
+      print(json.dumps(session.multiple_status(["1000020"])))''', XSUB_REGISTRY=str(registry))
+    self.assertEqual(out["1000020"]["status"], "running")
+    with sqlite3.connect(str(registry)) as conn:
+      self.assertEqual(conn.execute("SELECT status FROM jobs WHERE job_id = '1000020'").fetchall(), [("submitted",)])
+
+  def test_snapshots_are_bound_to_the_thread(self):
+    out = self.run_python('''if True:
+      import json,threading
+      from schedulers import cache
+      seen = []
+      with cache.in_memory({}, 5.0):
+        t = threading.Thread(target=lambda: seen.append(cache.enabled()))
+        t.start(); t.join()
+        seen.append(cache.enabled())
+      print(json.dumps(seen))''')
+    self.assertEqual(out, [False, True])
+
+if __name__ == "__main__":
+  unittest.main()
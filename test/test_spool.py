@@ -0,0 +1,38 @@
+import unittest
+from stub_case import StubTestCase
+
+LIMIT_ERROR = "sbatch: error: AssocMaxSubmitJobLimit"
+
+class SpoolTest(StubTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.env["XSUB_SPOOL"] = "on"
+
+  def test_rejected_job_is_spooled_and_dispatched_later(self):
+    job_id = self.run_json("xsub", "job.sh", XSUB_STUB_FAIL=f"sbatch={LIMIT_ERROR}")["job_id"]
+    self.assertEqual(job_id, "spool-1")
+    self.assertEqual(self.run_json("xstat", "-m", job_id)[job_id]["status"], "queued")
+
+    result = self.run_command("xspool", XSUB_STUB_FAIL=f"sbatch={LIMIT_ERROR}")
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertEqual(self.run_json("xstat", "-m", job_id)[job_id]["status"], "queued")
+
+    result = self.run_command("xspool")
+    self.assertEqual(result.returncode, 0, result.stderr)
+    out = self.run_json("xstat", "-m", job_id)[job_id]
+    self.assertIn("dispatched as 11000001", out["raw_output"])
+
+  def test_spooled_job_is_cancelled(self):
+    job_id = self.run_json("xsub", "job.sh", XSUB_STUB_FAIL=f"sbatch={LIMIT_ERROR}")["job_id"]
+    self.assertEqual(self.run_json("xdel", "-m", job_id)[job_id]["result"], "deleted")
+    self.run_command("xspool")
+    self.assertEqual(self.run_json("xstat", "-m", job_id)[job_id]["status"], "finished")
+
+  def test_other_errors_are_not_spooled(self):
+    result = self.run_command("xsub", "job.sh", XSUB_STUB_FAIL="sbatch=sbatch: error: invalid partition")
+    self.assertNotEqual(result.returncode, 0)
+    self.assertIn("invalid partition", result.stderr + result.stdout)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,47 @@
+import json,unittest
+from stub_case import StubTestCase
+
+# status.index_lines and status.lookup, which answer all the requested ids from a single parse of the queue output
+
+class StatusIndexTest(StubTestCase):
+
+  def test_index_lines(self):
+    out = self.run_python('''if True:
+      import json
+      from schedulers import status
+      lines = [
+        "Job ID                    Name             User            Time Use S Queue",
+        "------------------------- ---------------- --------------- -------- - -----",
+        "1234.server               job              someone         00:01:23 R batch",
+        "1235.server               job              someone         00:00:00 Q batch",
+        "1235.server               job              someone         00:00:10 R batch",
+        "",
+      ]
+      print(json.dumps([status.index_lines(lines), status.index_lines(["JOB_ID ST", "x 77 RUN"], column=1)]))''')
+    self.assertEqual(out[0], {
+      "1234": "1234.server               job              someone         00:01:23 R batch",
+      "1235": "1235.server               job              someone         00:00:10 R batch",   # the last line wins
+    })
+    self.assertEqual(out[1], {"77": "x 77 RUN"})
+
+  def test_lookup(self):
+    out = self.run_python('''if True:
+      import json
+      from schedulers import status
+      index = status.index_lines(["1234.server R"])
+      print(json.dumps(status.lookup(["1234", "1234.server", "99"], index, lambda l: ("running", l), "not found")))''')
+    self.assertEqual(out, {"1234": ["running", "1234.server R"], "1234.server": ["running", "1234.server R"], "99": ["finished", "not found"]})
+
+  def test_single_query_for_many_ids(self):
+    ids = [str(1000000 + i) for i in range(10)] + ["999"]
+    for (xsub_type,command) in (("slurm", "squeue"), ("torque", "qstat"), ("pbs_pro", "qstat"), ("fugaku", "pjstat")):
+      with self.subTest(xsub_type=xsub_type):
+        log = self.dir.joinpath(f"{xsub_type}.log")
+        out = self.run_json("xstat", "-m", *ids, XSUB_TYPE=xsub_type, XSUB_STUB_LOG=str(log))
+        self.assertEqual(list(out), ids)
+        self.assertEqual(out["999"]["status"], "finished")
+        self.assertEqual({out[j]["status"] for j in ids[:10]}, {"queued", "running"})
+        self.assertEqual([c[0] for c in map(json.loads, log.read_text().splitlines())], [command])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,40 @@
+import json,subprocess,unittest
+from stub_case import StubTestCase
+
+class TraceTest(StubTestCase):
+
+  def records(self):
+    return [json.loads(l) for l in self.dir.joinpath("trace.jsonl").read_text().splitlines()]
+
+  def test_phases_and_commands(self):
+    trace = str(self.dir.joinpath("trace.jsonl"))
+    self.run_json("xstat", "-m", "1000001", "1000002", XSUB_TRACE=trace)
+    records = self.records()
+    [squeue] = [r for r in records if r["type"] == "command"]
+    self.assertEqual((squeue["name"], squeue["returncode"], squeue["xsub_type"]), ("squeue", 0, "slurm"))
+    phases = {r["name"] for r in records if r["type"] == "phase"}
+    self.assertTrue({"multiple_status", "output", "total"} <= phases, phases)
+    self.assertEqual({r["entry"] for r in records}, {"xstat"})
+
+    rows = [json.loads(l) for l in self.run_command("xtrace", "--json", trace).stdout.splitlines()]
+    self.assertIn({"entry": "", "xsub_type": "slurm", "kind": "command", "name": "squeue", "count": 1}, [{k: r[k] for k in ("entry", "xsub_type", "kind", "name", "count")} for r in rows])
+
+  def test_backend_of_multi(self):
+    self.dir.joinpath("multi.json").write_text(json.dumps({"backends": {"a": {"type": "slurm"}, "b": {"type": "torque"}}}))
+    trace = str(self.dir.joinpath("trace.jsonl"))
+    self.run_json("xstat", "-m", "a:1000001", "b:1000001", XSUB_TYPE="multi", XSUB_MULTI_CONFIG=str(self.dir.joinpath("multi.json")), XSUB_TRACE=trace)
+    commands = {(r["name"], r["xsub_type"], r.get("backend")) for r in self.records() if r["type"] == "command"}
+    self.assertEqual(commands, {("squeue", "slurm", "a"), ("qstat", "torque", "b")})
+
+  def test_concurrent_writers(self):
+    trace = str(self.dir.joinpath("trace.jsonl"))
+    env = dict(self.env, XSUB_TRACE=trace)
+    procs = [subprocess.Popen(["xstat", "-m", "1000001"], env=env, cwd=self.dir, stdout=subprocess.DEVNULL) for _ in range(8)]
+    for p in procs:
+      p.wait(timeout=60)
+    records = self.records()   # every line is a whole record
+    self.assertEqual(len({r["pid"] for r in records}), 8)
+    self.assertEqual(sum(1 for r in records if r["type"] == "command"), 8)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,20 @@
+import json,unittest
+from stub_case import StubTestCase
+
+class WatchTest(StubTestCase):
+
+  def test_gives_up_after_consecutive_failures(self):
+    result = self.run_command("xstat", "--watch", "--interval", "0.01", "--max-failures", "3", "1000001", XSUB_STUB_FAIL="squeue=slurm_load_jobs error: Unable to contact slurm controller")
+    self.assertEqual(result.returncode, 1)
+    warnings = [l for l in result.stderr.splitlines() if l.startswith("[Warning] poll failed")]
+    self.assertEqual(len(warnings), 2)
+    self.assertIn("[Error] giving up after 3 failed polls", result.stderr)
+
+  def test_finishes(self):
+    # the stub never lists the submitted jobs, so 11000001 is finished at the first poll
+    result = self.run_command("xstat", "--watch", "--interval", "0.01", "11000001")
+    self.assertEqual(result.returncode, 0, result.stderr)
+    self.assertEqual(json.loads(result.stdout)["status"], "finished")
+
+if __name__ == "__main__":
+  unittest.main()